@@ -1,31 +1,58 @@
 # File: main.py
 """
 This file contains the main entry point for the program
+
+Modules are imported by the mode that uses them, the command line never imports the GUI.
+The project is loaded once, when the mode needs it.
 """
 
-#from gui import GUI
 from src.arguments import parse_arguments
-from src.app import App
-from src.command_line import CommandLine
-import src.gui.gui as gui
-from test import test_app
-from src.logger import *
+from src.startup_trace import StartupTrace
+import sys
 
 if __name__ == "__main__":
     args = parse_arguments()
+    trace = StartupTrace(args.startup_trace).start()
+    with trace.phase("import logger"):
+        from src.logger import logger, init_logger
+
+    app = None
     if args.DEBUG:
         logger.info("Running the program in debug mode")
         init_logger(logger, "DEBUG")
-        app = test_app()
+        with trace.phase("load test project"):
+            from test import test_app
+            app = test_app()
     else:
         logger.info("Running the program in normal mode")
         init_logger(logger, args.log_level)
-        app = App()
 
-    if args.no_gui:
+    if args.lifetime:
+        with trace.phase("import command line"):
+            from src.app import App
+            from src.command_line import print_lifetimes
+        with trace.phase("load project"):
+            app = app if app is not None else App(args.project)
+        trace.report()
+        print_lifetimes(app)
+    elif args.no_gui:
         logger.info("Running the program without GUI")
-        app_cmd = CommandLine(app)
+        with trace.phase("import command line"):
+            from src.command_line import CommandLine
+        command_line = CommandLine(app, project_file=args.project)
+        if args.command:
+            with trace.phase("load project"):
+                command_line.load()
+        trace.report()
+        sys.exit(command_line.run(args.command))
     else:
         logger.info("Running the program with GUI")
-        app_gui = gui.GUI(app)
-        app_gui.mainloop()
\ No newline at end of file
+        with trace.phase("import gui"):
+            import src.gui.gui as gui
+            from src.app import App
+        with trace.phase("load project"):
+            app = app if app is not None else App(args.project)
+        with trace.phase("build gui"):
+            app_gui = gui.GUI(app)
+        trace.report()
+        app_gui.mainloop()
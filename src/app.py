@@ -6,24 +6,70 @@ This file contains all application logic
 from src.logger import logger
 from src.sequence import Sequence
 from src.elements import Element
+from src.element_library import default_library
 from src.power_state import PowerState
 from src.state import State
 from src.battery import Battery
+from src.network import Network
+from src.sweep import Sweep
+from src.tolerance import ToleranceAnalysis
+from src.batch import evaluate_batch
+from src.usage_index import UsageIndex
+from src.bundle import Bundle, LazySequences, write_bundle
+from src.loader import LoadReport, load_directory, load_files
+from src.sequence_index import SequenceIndex, SEQUENCE_INDEX_FILE, SUMMARY_FIELDS, summarize, get_content_hash, get_element_hash
+from src.atomic_file import BatchWriter
+from src.database import ElementDatabase
+from src.trace import Trace, write_simulation
+from src.export import export_csv, export_binary
+from src.measurement import propose_power_states, apply_power_states
+from src.result_cache import ResultCache
+from src.membership import compile_memberships
+from src.watcher import ChangeSet, DirectoryWatcher
 from src.file_path import *
 import json
 import os
+import weakref
 
 class App:
-    def __init__(self):
+    def __init__(self, project_file: str=None):
+        """
+        project_file is a project bundle, None loads the per-file layout of data/
+        With a bundle, sequences are loaded on first access,
+        loaded_seqs and the usage index only hold the loaded ones
+        """
 
         # Attributes
         #================================
-        self.loaded_elts = self.__load_elements()
-        self.dict_elts = {elt.name: elt for elt in self.loaded_elts}
-        self.loaded_seqs = self.__load_sequences()
-        self.dict_seqs = {seq.name: seq for seq in self.loaded_seqs}
-        self.current_sequence = self.loaded_seqs[0] if len(self.loaded_seqs) > 0 else None
-        self.battery = self.__load_battery()
+        self.project_file = project_file
+        self.usage_index = UsageIndex()
+        self.load_report = LoadReport() # Files of the per-file layout that could not be loaded
+        self.saved_elements = {} # {element: (version, file name)} as saved in elements_path
+        self.saved_sequences = {} # {sequence: (version, content hash, name, file name)} as saved in sequences_path
+        self.element_hashes = weakref.WeakKeyDictionary() # {element: (version, content hash)}, checks the summaries of the sequence index
+        self.database = None # Optional ElementDatabase mirroring the element library
+        self.database_versions = weakref.WeakKeyDictionary() # {element: version} as written in the database
+        self.result_cache = ResultCache(cache_path, hash_cache=self.element_hashes) # Profiles, lifetimes and sweeps computed before
+        if project_file is None:
+            self.loaded_elts = self.__load_elements()
+            self.dict_elts = {elt.name: elt for elt in self.loaded_elts}
+            self.loaded_seqs = []
+            self.sequence_index = SequenceIndex(sequences_path).load()
+            self.dict_seqs = self.__load_sequences()
+            self.battery = self.__load_battery()
+            self.element_watcher = DirectoryWatcher(elements_path)
+            self.sequence_watcher = DirectoryWatcher(sequences_path, exclude=(SEQUENCE_INDEX_FILE,))
+        else:
+            bundle = Bundle(project_file)
+            self.sequence_index = None
+            self.loaded_elts = [Element.from_dict(self, dict_element) for dict_element in bundle.read_section("elements")]
+            self.dict_elts = {elt.name: elt for elt in self.loaded_elts}
+            self.loaded_seqs = []
+            self.dict_seqs = LazySequences(bundle, self.dict_elts, self.__sequence_loaded)
+            self.battery = Battery.from_dict(self, bundle.read_section("battery"))
+            self.element_watcher = None
+            self.sequence_watcher = None
+        self.current_sequence = self.dict_seqs[next(iter(self.dict_seqs))] if len(self.dict_seqs) > 0 else None
         self.current_state = 0
 
     # Load and save functions
@@ -32,14 +78,10 @@ class App:
         """
         Load elements from a file
         """
-        loaded_elts = []
-        for filename in os.listdir(file_path):
-            if filename.endswith(".json"):
-                with open(file_path + filename, "r") as file:
-                    logger.debug(f"Loading element from {filename}")
-                    data = file.read()
-                    element = Element.from_dict(self, json.loads(data))
-                    loaded_elts.append(element)
+        loaded_elts, report = load_directory(file_path, lambda dict_element: Element.from_dict(self, dict_element))
+        self.load_report.merge(report)
+        for element, element_file in zip(loaded_elts, report.files):
+            self.saved_elements[element] = (element.version, os.path.basename(element_file))
         if len(loaded_elts) == 0:
             logger.info("No element to load")
         return loaded_elts
@@ -47,18 +89,22 @@ class App:
     def __load_sequences(self, file_path: str = sequences_path):
         """
         Load sequences from a file
-        """
-        loaded_seqs = []
-        for filename in os.listdir(file_path):
-            if filename.endswith(".json"):
-                with open(file_path + filename, "r") as file:
-                    logger.debug(f"Loading sequence from {filename}")
-                    data = file.read()
-                    sequence = Sequence.from_dict(self, json.loads(data))
-                    loaded_seqs.append(sequence)
-        if len(loaded_seqs) == 0:
+        Only the files changed since the sequence index was written are read,
+        the other sequences are loaded on first access
+        """
+        known_hashes = self.get_hashes_by_element()
+        stale_files = self.sequence_index.refresh({element.name: content_hash for element, content_hash in known_hashes.items()})
+        stale_seqs, report = load_files(stale_files, lambda dict_sequence: Sequence.from_dict(self, dict_sequence, self.dict_elts))
+        self.load_report.merge(report)
+        for sequence, sequence_file in zip(stale_seqs, report.files):
+            self.sequence_index.update(sequence, sequence_file, known_hashes)
+        self.sequence_index.save()
+        dict_seqs = LazySequences(self.sequence_index, self.dict_elts, self.__sequence_loaded)
+        for sequence in stale_seqs:
+            dict_seqs.set_loaded(sequence)
+        if len(dict_seqs) == 0:
             logger.info("No sequence to load")
-        return loaded_seqs
+        return dict_seqs
     
     def __load_battery(self, file_path: str = battery_file):
         """
@@ -70,20 +116,273 @@ class App:
             battery = Battery.from_dict(self, json.loads(data))
         return battery
     
+    def __sequence_loaded(self, sequence: Sequence):
+        """
+        Called when a sequence of the bundle or of the sequence index is loaded
+        """
+        self.loaded_seqs.append(sequence)
+        self.usage_index.add_sequence(sequence)
+        if self.sequence_index is not None and sequence.name in self.sequence_index.entries:
+            # The index entry was computed from the same file
+            entry = self.sequence_index.get_entry(sequence.name)
+            sequence_file, content_hash = entry["file"], entry["hash"]
+            self.saved_sequences[sequence] = (sequence.version, content_hash, sequence.name, sequence_file)
+            self.result_cache.add_loaded(sequence, content_hash)
+        else:
+            self.result_cache.add_loaded(sequence)
+
+    def reload_changes(self):
+        """
+        Reload the element and sequence files changed on disk since the last call, see watcher.py
+        Objects are updated in place, files written by save_elements and save_sequences are not reloaded
+        Returns the ChangeSet of the elements and the ChangeSet of the sequences
+        """
+        if self.element_watcher is None:
+            return ChangeSet(), ChangeSet()
+        element_changes = self.__reload_elements(*self.element_watcher.poll())
+        sequence_changes = self.__reload_sequences(*self.sequence_watcher.poll())
+        if not (element_changes.is_empty() and sequence_changes.is_empty()):
+            logger.info(f"Reloaded elements: {element_changes}, sequences: {sequence_changes}")
+        return element_changes, sequence_changes
+
+    def __reload_elements(self, changed_files: list, removed_files: list):
+        changes = ChangeSet()
+        elements_by_file = {element_file: element for element, (_, element_file) in self.saved_elements.items()}
+        # Elements of removed files, by name, a file renamed keeps its element
+        removed_elements = {}
+        for file_path in removed_files:
+            element = elements_by_file.get(os.path.basename(file_path))
+            if element is not None:
+                removed_elements[element.name] = element
+        dict_elements, report = load_files(changed_files, lambda dict_element: dict_element)
+        self.load_report.merge(report)
+        for dict_element, element_file in zip(dict_elements, report.files):
+            file_name = os.path.basename(element_file)
+            try:
+                element = elements_by_file.get(file_name) or removed_elements.pop(dict_element["name"], None)
+                if element is None:
+                    if dict_element["name"] in self.dict_elts:
+                        raise ValueError(f"Element {dict_element['name']} already exists")
+                    element = Element.from_dict(self, dict_element)
+                    self.add_element(element)
+                    changes.added.add(element.name)
+                elif element.to_dict() != dict_element:
+                    if dict_element["name"] != element.name:
+                        self.rename_element(element, dict_element["name"])
+                    element.set_from_dict(dict_element)
+                    if self.database is not None:
+                        self.database.import_elements([element.to_dict()])
+                    changes.changed.add(element.name)
+            except (KeyError, TypeError, ValueError) as error:
+                self.load_report.add_error(element_file, error)
+                continue
+            self.saved_elements[element] = (element.version, file_name)
+        for element in removed_elements.values():
+            if self.dict_elts.get(element.name) is element:
+                self.remove_element(element)
+                changes.removed.add(element.name)
+            self.saved_elements.pop(element, None)
+        return changes
+
+    def __reload_sequences(self, changed_files: list, removed_files: list):
+        changes = ChangeSet()
+        names_by_file = dict(self.sequence_index.names_by_file)
+        known_hashes = self.get_hashes_by_element()
+        removed_names = {names_by_file[os.path.basename(file_path)] for file_path in removed_files if os.path.basename(file_path) in names_by_file}
+        dict_sequences, report = load_files(changed_files, lambda dict_sequence: dict_sequence)
+        self.load_report.merge(report)
+        for dict_sequence, sequence_file in zip(dict_sequences, report.files):
+            name = dict_sequence.get("name")
+            old_name = names_by_file.get(os.path.basename(sequence_file))
+            if old_name is None and name in removed_names:
+                old_name = name # File renamed
+            removed_names.discard(old_name)
+            try:
+                if old_name is not None and self.dict_seqs.is_loaded(old_name):
+                    sequence = self.dict_seqs[old_name]
+                    if get_content_hash(sequence.to_dict()) != get_content_hash(dict_sequence):
+                        if name != old_name and name in self.dict_seqs:
+                            raise ValueError(f"Sequence {name} already exists")
+                        sequence.set_from_dict(dict_sequence)
+                        changes.changed.add(name)
+                    if name != old_name:
+                        del self.dict_seqs[old_name]
+                        self.sequence_index.remove(old_name)
+                        self.dict_seqs[name] = sequence
+                        changes.removed.add(old_name)
+                    self.sequence_index.update(sequence, sequence_file, known_hashes)
+                    self.saved_sequences[sequence] = (sequence.version, get_content_hash(sequence.to_dict()), sequence.name, os.path.basename(sequence_file))
+                    continue
+                if name != old_name and name in self.dict_seqs:
+                    raise ValueError(f"Sequence {name} already exists")
+                sequence = Sequence.from_dict(self, dict_sequence, self.dict_elts)
+            except (KeyError, TypeError, ValueError) as error:
+                self.load_report.add_error(sequence_file, error)
+                continue
+            if old_name is None:
+                changes.added.add(name)
+            else:
+                # Never loaded, only its index entry was used
+                if self.sequence_index.get_entry(old_name)["hash"] != get_content_hash(dict_sequence):
+                    changes.changed.add(name)
+                if old_name != name:
+                    del self.dict_seqs[old_name]
+                    self.sequence_index.remove(old_name)
+                    changes.removed.add(old_name)
+            self.sequence_index.update(sequence, sequence_file, known_hashes)
+            self.dict_seqs[name] = sequence
+            self.__sequence_loaded(sequence)
+        for name in removed_names:
+            if name not in self.dict_seqs:
+                continue
+            if self.dict_seqs.is_loaded(name):
+                sequence = self.dict_seqs[name]
+                self.remove_sequence(sequence)
+                self.saved_sequences.pop(sequence, None)
+                if self.current_sequence is sequence:
+                    self.current_sequence = self.dict_seqs[next(iter(self.dict_seqs))] if len(self.dict_seqs) > 0 else None
+            else:
+                del self.dict_seqs[name]
+                self.sequence_index.remove(name)
+            changes.removed.add(name)
+        self.sequence_index.save()
+        return changes
+
+    def load_sequences_using(self, element_name: str):
+        """
+        Load the sequences using an element, found from the sequence index or the bundle header
+        The usage index then holds every usage of the element
+        """
+        for name in self.dict_seqs:
+            if not self.dict_seqs.is_loaded(name) and element_name in self.dict_seqs.get_element_names(name):
+                self.dict_seqs[name]
+
+    def load_all_sequences(self):
+        """
+        Load every sequence of the project, returns the list of all sequences
+        """
+        return [self.dict_seqs[name] for name in self.dict_seqs]
+
+    def save_project(self, file_path: str = None):
+        """
+        Save the project to a bundle, None is the bundle it was loaded from
+        Sequences never loaded are copied without being parsed
+        """
+        if file_path is None:
+            file_path = self.project_file
+        if file_path is None:
+            raise ValueError("No project file to save to")
+        raw_sequences = {name: self.dict_seqs.get_raw(name) for name in self.dict_seqs}
+        sequence_elements = {name: self.dict_seqs.get_element_names(name) for name in self.dict_seqs}
+        write_bundle(file_path, [element.to_dict() for element in self.loaded_elts], self.battery.to_dict(), raw_sequences, sequence_elements)
+        if file_path == self.project_file:
+            self.dict_seqs.set_source(Bundle(file_path))
+
     def save_elements(self, file_path: str = elements_path):
         """
         Save elements to a file
-        """
-        for element in self.loaded_elts:
-            element.to_json(file_path)
+        In elements_path, only the elements changed since they were loaded or saved are written,
+        files of renamed and removed elements are removed
+        """
+        tracked = os.path.normpath(file_path) == os.path.normpath(elements_path)
+        saved = self.saved_elements if tracked else {}
+        written = []
+        with BatchWriter() as writer:
+            for element in self.loaded_elts:
+                version, element_file = saved.get(element, (None, None))
+                if version != element.version or element_file != element.get_file_name():
+                    element.to_json(file_path, writer)
+                    written.append(element)
+                    if element_file is not None and element_file != element.get_file_name():
+                        writer.remove(os.path.join(file_path, element_file))
+            loaded_elts = set(self.loaded_elts)
+            removed = [element for element in saved if element not in loaded_elts]
+            for element in removed:
+                writer.remove(os.path.join(file_path, saved[element][1]))
+            count = len(writer.writes)
+        if tracked:
+            for element in removed:
+                del saved[element]
+            for element in written:
+                saved[element] = (element.version, element.get_file_name())
+        if self.database is not None:
+            self.database.import_elements([element.to_dict() for element in written])
+        logger.info(f"{count} elements saved")
 
     def save_sequences(self, file_path: str = sequences_path):
         """
         Save sequences to a file
-        """
-        for sequence in self.loaded_seqs:
-            sequence.to_json(file_path)
+        In sequences_path, only the sequences whose version changed since they were loaded or saved
+        are hashed, written if their content changed and indexed again,
+        files of renamed and removed sequences are removed
+        Sequences never loaded are not changed
+        """
+        tracked = os.path.normpath(file_path) == os.path.normpath(sequences_path) and self.sequence_index is not None
+        saved = self.saved_sequences if tracked else {}
+        files = {}
+        changed = []
+        with BatchWriter() as writer:
+            for sequence in self.loaded_seqs:
+                saved_version, content_hash, name, sequence_file = saved.get(sequence, (None, None, None, None))
+                if sequence_file is None or name != sequence.name:
+                    if sequence_file is not None:
+                        writer.remove(os.path.join(file_path, sequence_file))
+                    sequence_file = sequence.get_file_name()
+                    saved_version, content_hash = None, None
+                if saved_version != sequence.version:
+                    saved_hash, content_hash = content_hash, get_content_hash(sequence.to_dict())
+                    if saved_hash != content_hash:
+                        sequence.to_json(file_path, writer, sequence_file)
+                    changed.append(sequence)
+                files[sequence] = (sequence.version, content_hash, sequence.name, sequence_file)
+            old_names = [name for sequence, (_, _, name, _) in saved.items() if sequence not in files or name != sequence.name]
+            for sequence, (_, _, _, sequence_file) in saved.items():
+                if sequence not in files:
+                    writer.remove(os.path.join(file_path, sequence_file))
+            count = len(writer.writes)
+        if tracked:
+            current_names = {name for _, _, name, _ in files.values()}
+            for name in old_names:
+                if name not in current_names and not (name in self.dict_seqs and not self.dict_seqs.is_loaded(name)):
+                    self.sequence_index.remove(name)
+            known_hashes = self.get_hashes_by_element()
+            for sequence in changed:
+                _, content_hash, _, sequence_file = files[sequence]
+                self.sequence_index.update(sequence, os.path.join(file_path, sequence_file), known_hashes, content_hash)
+            self.sequence_index.save()
+            self.saved_sequences = files
+        logger.info(f"{count} sequences saved")
     
+    def open_database(self, file_path: str = database_file):
+        """
+        Open the SQLite element database, an empty database is filled with the loaded elements
+        """
+        self.database = ElementDatabase(file_path)
+        if self.database.count() == 0:
+            self.database.import_elements([element.to_dict() for element in self.loaded_elts])
+            for element in self.loaded_elts:
+                self.database_versions[element] = element.version
+
+    def __sync_database(self):
+        """
+        Write in the database the loaded elements changed since they were written,
+        so queries see the values being edited, not only the saved ones
+        """
+        changed = [element for element in self.loaded_elts if self.database_versions.get(element) != element.version]
+        if changed:
+            self.database.import_elements([element.to_dict() for element in changed])
+            for element in changed:
+                self.database_versions[element] = element.version
+
+    def import_database(self, file_path: str = elements_path):
+        """
+        Import every element file of a directory in the database, in one transaction
+        Returns the LoadReport of the files
+        """
+        if self.database is None:
+            raise ValueError("No database opened")
+        return self.database.import_directory(file_path)
+
     def save_battery(self, file_path: str = battery_file):
         """
         Save battery to a file
@@ -98,6 +397,8 @@ class App:
         """
         self.loaded_elts.append(element)
         self.dict_elts[element.name] = element
+        if self.database is not None:
+            self.database.import_elements([element.to_dict()])
 
     def add_sequence(self, sequence: Sequence):
         """
@@ -105,6 +406,7 @@ class App:
         """
         self.loaded_seqs.append(sequence)
         self.dict_seqs[sequence.name] = sequence
+        self.usage_index.add_sequence(sequence)
 
     def add_state(self, sequence: Sequence, state: State):
         """
@@ -112,6 +414,24 @@ class App:
         """
         sequence.add_state(state)
 
+    def import_measurement(self, file_path: str, element: Element = None, **options):
+        """
+        Set the power states of an element from a measured (time, current, voltage) csv trace, see measurement.py
+        None creates a new element named after the file
+        """
+        proposal = propose_power_states(file_path, **options)
+        if element is None:
+            name = os.path.splitext(os.path.basename(file_path))[0]
+            if name in self.dict_elts:
+                raise ValueError(f"Element {name} already exists")
+            element = apply_power_states(Element(name, description=f"Measured from {os.path.basename(file_path)}"), proposal)
+            self.add_element(element)
+        else:
+            apply_power_states(element, proposal)
+            if self.database is not None:
+                self.database.import_elements([element.to_dict()])
+        return element
+
     # Getters
     #================================
     def get_element(self, index: int = -1):
@@ -119,11 +439,115 @@ class App:
             raise IndexError("Index out of range")
         return self.loaded_elts[index]
     
+    def get_element_usages(self, element_name: str):
+        """
+        Returns the set of (sequence, state index, power state) where the element is used
+        """
+        self.load_sequences_using(element_name)
+        return self.usage_index.get_usages(element_name)
+
+    def get_element_usage_count(self, element_name: str):
+        self.load_sequences_using(element_name)
+        return self.usage_index.get_usage_count(element_name)
+
+    def query_elements(self, power_state: str, field: str="power", low: float=None, high: float=None):
+        """
+        Returns the loaded elements with low <= value < high for the field ("power" or "time") of a power state
+        Example: query_elements("Sleep", "power", high=1e-6) for all parts sleeping under 1 µW
+        """
+        library = default_library
+        element_ids = library.select(power_state, field, low, high)
+        elements = []
+        for element_id, name in zip(element_ids, library.get_names(element_ids)):
+            element = self.dict_elts.get(name)
+            if element is not None and element.library is library and element.id == element_id:
+                elements.append(element)
+        return elements
+
+    def query_database(self, filters: list=None, sort: tuple=None, descending: bool=False, limit: int=None, offset: int=0):
+        """
+        Returns the elements of the database matching every filter, see database.py
+        Example: query_database([("Active", "power", "<", 5e-3)], sort=("Sleep", "power"))
+        Elements not loaded yet are loaded from the database
+        """
+        if self.database is None:
+            raise ValueError("No database opened")
+        self.__sync_database()
+        return [self.__get_database_element(dict_element) for dict_element in self.database.query(filters, sort, descending, limit, offset)]
+
+    def __get_database_element(self, dict_element: dict):
+        element = self.dict_elts.get(dict_element["name"])
+        if element is None:
+            element = Element.from_dict(self, dict_element)
+            self.loaded_elts.append(element)
+            self.dict_elts[element.name] = element
+            # Stored in the database, it is only written to a file once edited
+            self.saved_elements[element] = (element.version, element.get_file_name())
+            self.database_versions[element] = element.version
+        return element
+
+    def get_element_count(self, filters: list=None):
+        """
+        Returns the number of elements of the database matching filters, or of loaded elements
+        """
+        if self.database is None:
+            return len(self.loaded_elts)
+        self.__sync_database()
+        return self.database.count(filters)
+
+    def get_element_page(self, page: int=0, page_size: int=50, filters: list=None, sort: tuple=None, descending: bool=False):
+        """
+        Returns the elements of a page, from the database when it is opened
+        """
+        if self.database is None:
+            return self.loaded_elts[page*page_size:(page+1)*page_size]
+        return self.query_database(filters, sort, descending, page_size, page*page_size)
+
+    def get_element_hashes(self):
+        """
+        Returns {element name: content hash} of the loaded elements
+        """
+        return {element.name: content_hash for element, content_hash in self.get_hashes_by_element().items()}
+
+    def get_hashes_by_element(self):
+        """
+        Returns {element: content hash} of the loaded elements
+        Hashes are kept until the element changes
+        """
+        return {element: get_element_hash(element, self.element_hashes) for element in self.loaded_elts}
+
+    def get_sequence_summaries(self, sort_key: str=None, reverse: bool=False):
+        """
+        Returns the summaries (name, description, state_count, energy, max_power, duration, hash)
+        of every sequence, sorted by sort_key
+        Sequences not loaded yet are read from the sequence index,
+        unless one of their elements changed since they were indexed
+        """
+        summaries = {}
+        if self.sequence_index is not None:
+            summaries = {summary["name"]: summary for summary in self.sequence_index.get_summaries()}
+            element_hashes = self.get_element_hashes()
+        for name in self.dict_seqs:
+            if self.dict_seqs.is_loaded(name) or name not in summaries or not self.sequence_index.is_current(name, element_hashes):
+                summaries[name] = summarize(self.dict_seqs[name])
+        summaries = [summaries[name] for name in self.dict_seqs]
+        if sort_key is not None:
+            if sort_key not in SUMMARY_FIELDS:
+                raise ValueError(f"Invalid sort key: {sort_key}")
+            summaries.sort(key=lambda summary: summary[sort_key], reverse=reverse)
+        return summaries
+
     def get_max_power(self):
-        return self.current_sequence.get_max_power()
+        return self.get_profile().get_max_power()
     
     def get_max_time(self):
-        return self.current_sequence.get_max_time()
+        return self.get_profile().get_total_time()
+
+    def get_profile(self):
+        """
+        Returns the compiled power profile of the current sequence
+        """
+        return self.result_cache.get_profile(self.current_sequence)
 
     # Setters
     #================================
@@ -134,6 +558,23 @@ class App:
         self.current_sequence = self.dict_seqs[sequence_name]
         logger.info(f"Current sequence set to {sequence_name}")
 
+    def rename_element(self, element: Element, name: str):
+        """
+        Rename an element, states keep using it under its new name
+        Sequences using it are loaded first, so they are saved with the new name
+        """
+        if name in self.dict_elts:
+            raise ValueError(f"Element {name} already exists")
+        old_name = element.get_name()
+        self.load_sequences_using(old_name)
+        element.set_name(name)
+        del self.dict_elts[old_name]
+        self.dict_elts[element.get_name()] = element
+        self.usage_index.rename_element(old_name, element.get_name())
+        if self.database is not None:
+            self.database.remove(old_name)
+            self.database.import_elements([element.to_dict()])
+
     # Creaters
     #================================
     def create_element(self):
@@ -163,6 +604,9 @@ class App:
         """
         del self.dict_seqs[sequence.name]
         self.loaded_seqs.remove(sequence)
+        self.usage_index.remove_sequence(sequence)
+        if self.sequence_index is not None:
+            self.sequence_index.remove(sequence.name)
 
     def remove_state(self, state: State, sequence: Sequence=None):
         """
@@ -174,12 +618,21 @@ class App:
             sequence = self.current_sequence
         sequence.remove_state(state)
 
-    def remove_element(self, element: Element):
+    def remove_element(self, element: Element, cascade: bool=True):
         """
         Remove an element
-        """
+        With cascade, the element is also removed from every state using it,
+        sequences using it are loaded first
+        """
+        if cascade:
+            self.load_sequences_using(element.name)
+            states = {id(sequence.states[index]): sequence.states[index] for sequence, index, _ in self.usage_index.get_usages(element.name)}
+            for state in states.values():
+                state.remove_element(element)
         del self.dict_elts[element.name]
         self.loaded_elts.remove(element)
+        if self.database is not None:
+            self.database.remove(element.name)
     
     # Methods
     #================================
@@ -195,26 +648,120 @@ class App:
         """
         return self.current_sequence.generate_power_data()
 
+    def write_trace(self, file_path: str, n_cycles: int=1, sequence: Sequence=None):
+        """
+        Write the binary trace of a sequence repeated n_cycles times on the battery, see trace.py
+        None is the current sequence, returns the number of segments written
+        """
+        if sequence is None:
+            sequence = self.current_sequence
+        metadata = {"sequence": sequence.get_name(), "battery": self.battery.to_dict(), "n_cycles": n_cycles}
+        return write_simulation(file_path, sequence.get_profile(), self.battery, n_cycles, metadata=metadata)
+
+    def open_trace(self, file_path: str):
+        """
+        Open a binary trace, its records are memory mapped
+        """
+        return Trace(file_path)
+
+    def export_samples(self, file_path: str, sample_rate: float, n_repeat: int=1, binary: bool=False, sequence: Sequence=None):
+        """
+        Export the power of a sequence repeated n_repeat times, sampled at sample_rate, see export.py
+        None is the current sequence, returns the number of samples
+        """
+        if sequence is None:
+            sequence = self.current_sequence
+        export = export_binary if binary else export_csv
+        return export(file_path, sequence.get_profile(), sample_rate, n_repeat)
+
     def step_state(self, n_step: int=0):
         """
         Step the current state
+        The battery level is set to the level after n_step states, starting from a full battery
         """
-        self.battery.set_capacity(self.battery.capacity)
         final_state_index = n_step-1
         if final_state_index < 0:
             raise IndexError("Index out of range Too low")
         if final_state_index >= len(self.current_sequence.states):
             raise IndexError("Index out of range Too high")
         
-        for i in range(0, final_state_index+1):
-            state_powers, state_times = self.current_sequence.states[i].generate_power_data()
-            logger.debug(f"Power: {state_powers} Time: {state_times}")
-            for power, time in zip(state_powers, state_times):
-                logger.debug(f"Power: {power} Time: {time}")
-                self.battery.discharge(power, time)
-                logger.debug(self.battery.current_capacity)
+        level = self.battery.level_after(self.get_profile(), final_state_index, self.battery.get_capacity())
+        self.battery.set_current_capacity(level)
+        logger.debug(self.battery.current_capacity)
         self.current_state = final_state_index
 
-                    
-            
-            
+    def time_to_depletion(self):
+        """
+        Returns the time at which the battery is empty while running the current sequence once
+        None if the battery last the whole sequence
+        """
+        return self.battery.time_to_depletion(self.get_profile())
+
+    def get_lifetime(self, sequence: Sequence=None, battery: Battery=None):
+        """
+        Returns the time at which the battery is empty when the sequence repeats forever
+        None is the current sequence and the project battery
+        """
+        if sequence is None:
+            sequence = self.current_sequence
+        if battery is None:
+            battery = self.battery
+        return self.result_cache.get_lifetime(sequence, battery)
+
+    def get_lifetimes(self):
+        """
+        Returns the lifetime of the battery for every loaded sequence
+        """
+        return {sequence.get_name(): self.get_lifetime(sequence) for sequence in self.load_all_sequences()}
+
+    def create_network(self, node_counts: dict, random_phase: bool=True, seed: int=None):
+        """
+        Create a network with node_counts[sequence_name] nodes running each sequence
+        Every node gets a copy of the battery
+        """
+        network = Network()
+        for sequence_name, count in node_counts.items():
+            network.add_nodes(count, self.dict_seqs[sequence_name], self.battery, random_phase=random_phase, seed=seed)
+        return network
+
+    def create_sweep(self, capacities: list=None, efficiencies: list=None, input_powers: list=None, overrides: dict=None):
+        """
+        Create a parameter sweep of the current sequence around the current battery
+        """
+        return Sweep(self.current_sequence, self.battery, capacities, efficiencies, input_powers, overrides)
+
+    def run_sweep(self, sweep: Sweep, max_workers: int=None):
+        """
+        Run a sweep, results are kept in the result cache
+        """
+        return self.result_cache.run_sweep(sweep, max_workers)
+
+    def create_tolerance_analysis(self, sequence: Sequence=None):
+        """
+        Create a Monte Carlo tolerance analysis of a sequence on the current battery
+        None is the current sequence
+        """
+        if sequence is None:
+            sequence = self.current_sequence
+        return ToleranceAnalysis(sequence, self.battery)
+
+    def evaluate_batch(self, batteries: list, sequences: list=None):
+        """
+        Evaluate sequences against a list of batteries, returns a BatchResult
+        None is every sequence of the project
+        """
+        if sequences is None:
+            sequences = self.load_all_sequences()
+        self.compile_profiles(sequences)
+        return evaluate_batch(sequences, batteries)
+
+    def compile_profiles(self, sequences: list=None):
+        """
+        Compile together the profiles of the sequences not compiled yet, None is every sequence
+        Used before evaluating many sequences, one pass is cheaper than one compilation per sequence
+        """
+        if sequences is None:
+            sequences = self.load_all_sequences()
+        pending = [sequence for sequence in sequences if not sequence.has_profile()]
+        for sequence, profile in zip(pending, compile_memberships([sequence.get_membership() for sequence in pending])):
+            sequence.set_profile(profile)
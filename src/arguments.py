@@ -11,6 +11,13 @@ def parse_arguments():
                         choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
                         help='Set the logging level (default: %(default)s)')
     parser.add_argument("--no-gui", action="store_true", help="Run the program without GUI")
+    parser.add_argument("--project", dest="project", default=None,
+                        help="Load a single file project bundle instead of the data folder")
+    parser.add_argument("--lifetime", action="store_true", help="Print the battery lifetime of every sequence and exit")
     parser.add_argument("--DEBUG", action="store_true", help="Run the program in debug mode")
+    parser.add_argument("--startup-trace", dest="startup_trace", action="store_true",
+                        help="Print the import and load time of the startup, per module, to stderr")
+    parser.add_argument("command", nargs=argparse.REMAINDER,
+                        help="With --no-gui, the command to run and its options (simulate, lifetime, sweep, report, validate, jobs)")
 
     return parser.parse_args()
\ No newline at end of file
@@ -0,0 +1,101 @@
+# File: atomic_file.py
+"""
+This file contains the atomic file writers
+
+A file is written to a temporary file next to it, flushed to disk,
+then moved over the target with os.replace, so a crash leaves either
+the previous content or the new one, never a partial file.
+
+BatchWriter does the same for many files with one pass of fsyncs:
+every temporary file is written first, then all are synced, moved,
+and each directory is synced once.
+
+"""
+
+from src.logger import logger
+import os
+
+TEMPORARY_SUFFIX = ".tmp"
+
+# Function
+#===========================================================================
+def write_atomic(file_path: str, content):
+    """
+    Write content (str or bytes) to file_path atomically
+    """
+    with BatchWriter() as writer:
+        writer.write(file_path, content)
+
+def _fsync_directory(path: str):
+    """
+    Sync a directory entry, not supported on every platform
+    """
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    try:
+        fd = os.open(path or ".", os.O_RDONLY | os.O_DIRECTORY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+class BatchWriter:
+    def __init__(self):
+        self.writes = {} # {file path: bytes}
+        self.removes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        return False
+
+    # Methods
+    #===========================================================================
+    def write(self, file_path: str, content):
+        self.writes[os.path.normpath(file_path)] = content.encode() if isinstance(content, str) else content
+
+    def remove(self, file_path: str):
+        self.removes.append(os.path.normpath(file_path))
+
+    def commit(self):
+        """
+        Write every pending file, returns the number of files written
+        """
+        temporary_paths = []
+        try:
+            for file_path, content in self.writes.items():
+                temporary_path = file_path + TEMPORARY_SUFFIX
+                temporary_paths.append(temporary_path)
+                with open(temporary_path, "wb") as file:
+                    file.write(content)
+            for temporary_path in temporary_paths:
+                with open(temporary_path, "rb+") as file:
+                    os.fsync(file.fileno())
+            for temporary_path, file_path in zip(temporary_paths, self.writes):
+                os.replace(temporary_path, file_path)
+        except OSError:
+            for temporary_path in temporary_paths:
+                if os.path.exists(temporary_path):
+                    os.remove(temporary_path)
+            raise
+        for file_path in self.removes:
+            if file_path in self.writes:
+                continue # Replaced by a new file of the same name
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+        for directory in {os.path.dirname(file_path) for file_path in list(self.writes) + self.removes}:
+            _fsync_directory(directory)
+        count = len(self.writes)
+        logger.debug(f"{count} files written, {len(self.removes)} removed")
+        self.writes = {}
+        self.removes = []
+        return count
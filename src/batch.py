@@ -0,0 +1,91 @@
+# File: batch.py
+"""
+This file contains the batch evaluation of sequences against batteries
+
+The energy, duration and peak power of each sequence are computed once,
+then broadcast against the parameters of every battery, giving
+sequences x batteries tables in one numpy operation.
+
+"""
+
+from src.logger import logger
+from src.sequence import Sequence
+from src.battery import Battery
+import json
+import numpy as np
+
+class BatchResult:
+    def __init__(self, sequence_names: list, battery_names: list, end_capacity: np.ndarray, cycles_to_empty: np.ndarray, power_violation: np.ndarray):
+        self.sequence_names = sequence_names
+        self.battery_names = battery_names
+        self.end_capacity = end_capacity # Battery level after one cycle
+        self.cycles_to_empty = cycles_to_empty # Number of whole cycles run before the battery empties, inf if it never empties
+        self.power_violation = power_violation # True if the sequence peak power is above the battery max output power
+
+    def to_dict(self):
+        return {
+            "sequences": self.sequence_names,
+            "batteries": self.battery_names,
+            "end_capacity": self.end_capacity.tolist(),
+            "cycles_to_empty": self.cycles_to_empty.tolist(),
+            "power_violation": self.power_violation.tolist()
+        }
+
+# Function
+#===========================================================================
+def evaluate_batch(sequences: list, batteries: list):
+    """
+    Evaluate every sequence against every battery, returns a BatchResult
+    Batteries start from their current capacity
+    """
+    profiles = [sequence.get_profile() for sequence in sequences]
+    energy = np.array([profile.get_energy() for profile in profiles], dtype=float)[:, None]
+    time = np.array([profile.get_total_time() for profile in profiles], dtype=float)[:, None]
+    max_power = np.array([profile.get_max_power() for profile in profiles], dtype=float)[:, None]
+
+    parameters = np.array([(battery.get_current_capacity(), battery.get_efficiency(), battery.get_input_power(), battery.get_max_output_power()) for battery in batteries], dtype=float).reshape(-1, 4)
+    current_capacity, efficiency, input_power, max_output_power = (column[None, :] for column in parameters.T)
+
+    net_energy = energy*(100/efficiency) - input_power*time
+    end_capacity = current_capacity - net_energy
+    # Deepest discharge inside a cycle, computed once per efficiency and input power
+    configurations = list(zip(parameters[:, 1], parameters[:, 2]))
+    peaks = {key: [get_cycle_peak(profile, *key) for profile in profiles] for key in set(configurations)}
+    cycle_peak = np.array([peaks[key] for key in configurations], dtype=float).T.reshape(len(profiles), len(batteries))
+    cycles_to_empty = get_cycles_to_empty(current_capacity, net_energy, cycle_peak)
+    power_violation = max_power > max_output_power
+    logger.info(f"Batch evaluation of {len(sequences)} sequences against {len(batteries)} batteries")
+    return BatchResult(
+        [sequence.get_name() for sequence in sequences],
+        [battery.get_name() for battery in batteries],
+        end_capacity,
+        cycles_to_empty,
+        power_violation
+    )
+
+def get_cycle_peak(profile, efficiency: float, input_power: float):
+    """
+    Returns the deepest discharge of a battery inside one cycle of a profile
+    """
+    _, net_peak = profile.get_net_energy(efficiency, input_power)
+    return float(net_peak[-1]) if net_peak.size > 0 else 0.0
+
+def get_cycles_to_empty(current_capacity, cycle_net, cycle_peak):
+    """
+    Returns the number of whole cycles run before the battery empties, inf if it never empties
+    Same cycle count as Battery.lifetime: the battery can empty inside a cycle
+    as soon as its level is below the cycle peak. Works on scalars and numpy arrays
+    """
+    current_capacity, cycle_net, cycle_peak = np.broadcast_arrays(*(np.asarray(value, dtype=float) for value in (current_capacity, cycle_net, cycle_peak)))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cycles = np.ceil((current_capacity - cycle_peak)/cycle_net)
+    cycles = np.where(cycle_net > 0, cycles, np.inf)
+    cycles = np.where((cycle_peak >= current_capacity) | (current_capacity <= 0), 0.0, cycles)
+    return cycles if cycles.ndim > 0 else float(cycles)
+
+def load_batteries(file_path: str):
+    """
+    Load a battery catalog, a json list of batteries saved with Battery.to_dict
+    """
+    with open(file_path, "r") as file:
+        return [Battery().from_dict(dict_battery) for dict_battery in json.load(file)]
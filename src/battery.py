@@ -5,7 +5,10 @@ This file contains the GUI class
 
 from src.logger import logger
 import json
+import numpy as np
 from src.file_path import *
+from src.atomic_file import write_atomic
+import math
 
 class Battery():
     def __init__(self,
@@ -90,8 +93,7 @@ class Battery():
         return battery
 
     def to_json(self, file_path: str=battery_file):
-        with open(file_path, "w") as file:
-            json.dump(self.to_dict(), file)
+        write_atomic(file_path, json.dumps(self.to_dict()))
 
     # Methods
     #================================
@@ -126,3 +128,83 @@ class Battery():
         self.current_capacity -= (power*time)*(100/self.efficiency)
         self.current_capacity += self.input_power*time
 
+    def net_energy(self, energy, time):
+        """
+        Returns the energy drawn from the battery when the load consumes energy over time
+        Accounts for efficiency and input power, works on scalars and numpy arrays
+        """
+        return energy*(100/self.efficiency) - self.input_power*time
+
+    def level_after(self, profile, index: int, initial: float=None):
+        """
+        Returns the battery level after state index of a compiled profile
+        """
+        if initial is None:
+            initial = self.current_capacity
+        return initial - self.net_energy(profile.get_state_energy(index), profile.get_state_end(index))
+
+    def time_to_depletion(self, profile, initial: float=None):
+        """
+        Returns the time at which the battery is empty while running the profile once
+        None if the battery is not depleted by the end of the profile
+        """
+        if initial is None:
+            initial = self.current_capacity
+        if initial <= 0:
+            return 0.0
+        net_energy, net_peak = profile.get_net_energy(self.efficiency, self.input_power)
+        index = int(np.searchsorted(net_peak, initial, side="left"))
+        if index >= net_peak.size:
+            return None
+        # Net energy is linear over a segment, solve for the crossing time
+        start_net = net_energy[index-1] if index > 0 else 0.0
+        rate = profile.power[index]*(100/self.efficiency) - self.input_power
+        return float(profile.start[index] + (initial - start_net)/rate)
+
+    def lifetime(self, profile, initial: float=None, phase: float=0.0):
+        """
+        Returns the time at which the battery is empty when the profile repeats forever
+        math.inf if the battery is never depleted
+
+        phase is the position in the profile at which the battery starts (in seconds)
+        Whole cycles are skipped using the net energy drawn per cycle,
+        only the first and last cycles are solved exactly
+        """
+        if initial is None:
+            initial = self.current_capacity
+        if initial <= 0:
+            return 0.0
+        total_time = profile.get_total_time()
+        if total_time == 0:
+            return math.inf
+        net_energy, net_peak = profile.get_net_energy(self.efficiency, self.input_power)
+        if net_peak.size == 0:
+            return math.inf
+        cycle_net = float(net_energy[-1]) # Energy lost over one cycle
+        cycle_peak = float(net_peak[-1]) # Deepest discharge inside one cycle
+
+        phase = phase % total_time
+        if phase > 0:
+            # First partial cycle, from phase to the end of the profile
+            phase_net = float(self.net_energy(profile.energy_at(phase), phase))
+            first = int(np.searchsorted(profile.end, phase, side="right"))
+            target = initial + phase_net
+            crossed = np.flatnonzero(net_energy[first:] >= target)
+            if crossed.size > 0:
+                index = first + int(crossed[0])
+                start_time = max(float(profile.start[index]), phase)
+                start_net = float(self.net_energy(profile.energy_at(start_time), start_time))
+                rate = profile.power[index]*(100/self.efficiency) - self.input_power
+                return start_time - phase + (target - start_net)/rate
+            return total_time - phase + self.lifetime(profile, initial - (cycle_net - phase_net))
+
+        if cycle_peak >= initial:
+            return self.time_to_depletion(profile, initial)
+        if cycle_net <= 0:
+            return math.inf
+        # Number of whole cycles before the battery can be emptied inside a cycle
+        n_cycles = math.ceil((initial - cycle_peak)/cycle_net)
+        remaining_time = self.time_to_depletion(profile, initial - n_cycles*cycle_net)
+        if remaining_time is None:
+            remaining_time = total_time
+        return n_cycles*total_time + remaining_time
@@ -0,0 +1,205 @@
+# File: bundle.py
+"""
+This file contains the single file project format
+
+A bundle holds the elements, the battery and the sequences of a project:
+    MAGIC                   8 bytes
+    header length           8 bytes, little endian
+    header                  json, {"sections": {name: [offset, length]}, "sequences": {name: [offset, length]},
+                            "elements": {sequence name: [names of the elements it uses]}}
+    sections                json bodies, offsets are counted from the end of the header
+
+The element table and the battery are read when the bundle is opened,
+each sequence body is read on first access. A bundle is written to a
+temporary file then moved over the previous one.
+
+"""
+
+from src.logger import logger
+from src.sequence import Sequence
+from src.loader import load_directory
+from src.sequence_index import SEQUENCE_INDEX_FILE, get_element_names
+from collections.abc import MutableMapping
+import json
+import os
+import struct
+
+MAGIC = b"PWRBNDL1"
+HEADER_LENGTH = struct.Struct("<Q")
+
+class Bundle:
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        with open(file_path, "rb") as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{file_path} is not a project bundle")
+            header_length, = HEADER_LENGTH.unpack(file.read(HEADER_LENGTH.size))
+            header = json.loads(file.read(header_length))
+        self.data_offset = len(MAGIC) + HEADER_LENGTH.size + header_length
+        self.sections = header["sections"]
+        self.sequences = header["sequences"] # {name: [offset, length]}, in saved order
+        self.sequence_elements = header.get("elements", {}) # {name: [element names]}, missing in older bundles
+
+    # Getters
+    #===========================================================================
+    def get_sequence_names(self):
+        return list(self.sequences.keys())
+
+    def read_raw(self, offset: int, length: int):
+        with open(self.file_path, "rb") as file:
+            file.seek(self.data_offset + offset)
+            return file.read(length)
+
+    def read_section(self, name: str):
+        return json.loads(self.read_raw(*self.sections[name]))
+
+    def read_sequence_raw(self, name: str):
+        """
+        Returns the json bytes of a sequence, without parsing them
+        """
+        return self.read_raw(*self.sequences[name])
+
+    def read_sequence(self, name: str):
+        return json.loads(self.read_sequence_raw(name))
+
+    def get_element_names(self, name: str):
+        """
+        Returns the names of the elements used by a sequence, read from its body for older bundles
+        """
+        if name not in self.sequence_elements:
+            self.sequence_elements[name] = get_element_names(self.read_sequence(name))
+        return self.sequence_elements[name]
+
+class LazySequences(MutableMapping):
+    """
+    Mapping {name: Sequence} over the sequences of a source, a Bundle or a SequenceIndex
+    A Sequence is built on first access, then on_load(sequence) is called
+    """
+    def __init__(self, source, dict_elts: dict, on_load=None):
+        self.source = source # Has get_sequence_names, get_element_names, read_sequence and read_sequence_raw
+        self.dict_elts = dict_elts
+        self.on_load = on_load
+        self.names = source.get_sequence_names() # Keeps the order of the mapping
+        self.loaded = {}
+
+    def __getitem__(self, name: str):
+        if name not in self.loaded:
+            if name not in self.names:
+                raise KeyError(name)
+            logger.debug(f"Loading sequence {name}")
+            self.set_loaded(Sequence.from_dict(None, self.source.read_sequence(name), self.dict_elts))
+        return self.loaded[name]
+
+    def __setitem__(self, name: str, sequence: Sequence):
+        if name not in self.names:
+            self.names.append(name)
+        self.loaded[name] = sequence
+
+    def __delitem__(self, name: str):
+        self.names.remove(name)
+        self.loaded.pop(name, None)
+
+    def __iter__(self):
+        return iter(list(self.names))
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def is_loaded(self, name: str):
+        return name in self.loaded
+
+    def set_loaded(self, sequence: Sequence):
+        """
+        Register a sequence of the source already built, then on_load(sequence) is called
+        """
+        self.loaded[sequence.name] = sequence
+        if self.on_load is not None:
+            self.on_load(sequence)
+
+    def get_raw(self, name: str):
+        """
+        Returns the json bytes of a sequence, from the source when it was never loaded
+        """
+        if name in self.loaded:
+            return json.dumps(self.loaded[name].to_dict()).encode()
+        return self.source.read_sequence_raw(name)
+
+    def get_element_names(self, name: str):
+        """
+        Returns the names of the elements used by a sequence, without loading it
+        """
+        if name in self.loaded:
+            return get_element_names(self.loaded[name].to_dict())
+        return self.source.get_element_names(name)
+
+    def set_source(self, source):
+        """
+        Read the sequences not loaded yet from another source, used after the project is saved
+        """
+        self.source = source
+
+# Function
+#===========================================================================
+def write_bundle(file_path: str, dict_elements: list, dict_battery: dict, raw_sequences: dict, sequence_elements: dict=None):
+    """
+    Write a bundle, raw_sequences is {name: json bytes}
+    sequence_elements is {name: [element names]}, None reads them from raw_sequences
+    """
+    if sequence_elements is None:
+        sequence_elements = {name: get_element_names(json.loads(body)) for name, body in raw_sequences.items()}
+    bodies = [json.dumps(dict_elements).encode(), json.dumps(dict_battery).encode()]
+    sections = {}
+    offset = 0
+    for name, body in zip(("elements", "battery"), bodies):
+        sections[name] = [offset, len(body)]
+        offset += len(body)
+    sequences = {}
+    for name, body in raw_sequences.items():
+        sequences[name] = [offset, len(body)]
+        bodies.append(body)
+        offset += len(body)
+    header = json.dumps({"sections": sections, "sequences": sequences, "elements": sequence_elements}).encode()
+
+    temporary_path = file_path + ".tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(MAGIC)
+        file.write(HEADER_LENGTH.pack(len(header)))
+        file.write(header)
+        for body in bodies:
+            file.write(body)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, file_path)
+    logger.info(f"Project saved to {file_path}: {len(dict_elements)} elements, {len(sequences)} sequences")
+
+def import_directory(file_path: str, elements_path: str, sequences_path: str, battery_file: str):
+    """
+    Build a bundle from the per-file layout (one json file per element and per sequence)
+    """
+    dict_elements, _ = load_directory(elements_path, lambda dict_element: dict_element)
+    dict_sequences, _ = load_directory(sequences_path, lambda dict_sequence: dict_sequence, exclude=(SEQUENCE_INDEX_FILE,))
+    raw_sequences = {dict_sequence["name"]: json.dumps(dict_sequence).encode() for dict_sequence in dict_sequences}
+    sequence_elements = {dict_sequence["name"]: get_element_names(dict_sequence) for dict_sequence in dict_sequences}
+    with open(battery_file, "r") as file:
+        dict_battery = json.load(file)
+    write_bundle(file_path, dict_elements, dict_battery, raw_sequences, sequence_elements)
+
+def export_directory(file_path: str, elements_path: str, sequences_path: str, battery_file: str):
+    """
+    Write the content of a bundle in the per-file layout
+    """
+    bundle = Bundle(file_path)
+    os.makedirs(elements_path, exist_ok=True)
+    os.makedirs(sequences_path, exist_ok=True)
+    for dict_element in bundle.read_section("elements"):
+        with open(os.path.join(elements_path, f"{dict_element['name']}.json"), "w") as file:
+            file.write(json.dumps(dict_element, indent=4))
+    for name in bundle.get_sequence_names():
+        with open(os.path.join(sequences_path, f"{name}.json"), "w") as file:
+            json.dump(bundle.read_sequence(name), file, indent=4)
+    with open(battery_file, "w") as file:
+        json.dump(bundle.read_section("battery"), file)
+    logger.info(f"Project {file_path} exported")
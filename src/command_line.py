@@ -1,15 +1,264 @@
 # File: commande_line.py
 """
 This file contains the command line interface
+
+Commands, run with: python main.py --no-gui <command> [options]
+    simulate    segments of sequences repeated on the battery (start, duration, power, battery level)
+    lifetime    battery lifetime of sequences
+    sweep       lifetime of a sequence over battery parameters and element overrides, optionally saved to a .npz file
+    report      energy, peak power, duration, lifetime and battery checks of sequences, optionally against a battery catalog
+    validate    files not loaded, missing elements and invalid values, exit code 1 on errors
+    jobs        json lines jobs read from a file or stdin, one json result line per job, see job_runner.py
+
+Results are written to stdout as json or csv (--format), jobs results as json lines.
+This file never imports the GUI, so it runs without customtkinter and matplotlib.
+
 """
 
 from src.logger import logger
 from src.app import App
+from src.elements import DummyElement
+from src.element_library import POWER_STATES
+from src.sweep import Sweep, save_sweep
+from src.batch import load_batteries
+from src.trace import simulate
+from src.job_runner import run_jobs, MAX_IN_FLIGHT
+import argparse
+import csv
+import json
+import math
+import numpy as np
+import sys
+
+SECONDS_PER_DAY = 86400
+FORMATS = ("json", "csv")
 
 class CommandLine:
-    def __init__(self, app: App = App()):
+    def __init__(self, app: App = None, output=None, project_file: str=None):
+        """
+        Without app, the project (project_file, None is the data folder) is loaded by the first command
+        """
         self.app = app
-
+        self.project_file = project_file
+        self.output = output if output is not None else sys.stdout
+        self.parser = build_parser()
         logger.info("Running the program without GUI")
-        logger.warning("The command line interface is not implemented yet")
-        raise NotImplementedError("The command line interface is not implemented yet")
\ No newline at end of file
+
+    def load(self):
+        """
+        Load the project if it is not loaded yet, returns the App
+        """
+        if self.app is None:
+            self.app = App(self.project_file)
+        return self.app
+
+    def run(self, arguments: list):
+        """
+        Run the command of arguments (the command line after --no-gui), returns the exit code
+        """
+        args = self.parser.parse_args(arguments)
+        if args.command is None:
+            self.parser.print_help(self.output)
+            return 2
+        self.load()
+        try:
+            return getattr(self, f"command_{args.command}")(args) or 0
+        except (KeyError, ValueError) as error:
+            logger.error(f"{args.command} failed: {error}")
+            print(f"error: {error}", file=sys.stderr)
+            return 1
+
+    # Getters
+    #===========================================================================
+    def get_sequences(self, names: list=None):
+        """
+        Returns the sequences of names, None is every sequence
+        """
+        if names is None:
+            return self.app.load_all_sequences()
+        for name in names:
+            if name not in self.app.dict_seqs:
+                raise ValueError(f"Unknown sequence: {name}")
+        return [self.app.dict_seqs[name] for name in names]
+
+    # Commands
+    #===========================================================================
+    def command_simulate(self, args):
+        writer = RowWriter(self.output, args.format, ("sequence", "start", "duration", "power", "battery"))
+        for sequence in self.get_sequences(args.sequence):
+            for chunk in simulate(sequence.get_profile(), self.app.battery, args.cycles):
+                writer.write_rows([sequence.get_name(), *row] for row in np.column_stack(chunk).tolist())
+        writer.close()
+
+    def command_lifetime(self, args):
+        writer = RowWriter(self.output, args.format, ("sequence", "lifetime_s", "lifetime_days"))
+        sequences = self.get_sequences(args.sequence)
+        self.app.compile_profiles(sequences)
+        for sequence in sequences:
+            lifetime = self.app.get_lifetime(sequence)
+            writer.write_row((sequence.get_name(), lifetime, lifetime/SECONDS_PER_DAY))
+        writer.close()
+
+    def command_sweep(self, args):
+        overrides = {}
+        for element_name, power_state, field, values in args.override or []:
+            if element_name not in self.app.dict_elts:
+                raise ValueError(f"Unknown element: {element_name}")
+            if power_state not in POWER_STATES:
+                raise ValueError(f"Invalid power state: {power_state}")
+            overrides[(element_name, power_state, field)] = [float(value) for value in values.split(",")]
+        sequence = self.get_sequences([args.sequence])[0]
+        sweep = Sweep(sequence, self.app.battery, args.capacity, args.efficiency, args.input_power, overrides)
+        columns = self.app.run_sweep(sweep, args.workers)
+        if args.output is not None:
+            save_sweep(columns, args.output)
+        writer = RowWriter(self.output, args.format, tuple(columns))
+        writer.write_rows(np.column_stack([np.asarray(column, dtype=float) for column in columns.values()]).tolist())
+        writer.close()
+
+    def command_report(self, args):
+        sequences = self.get_sequences(args.sequence)
+        batteries = load_batteries(args.batteries) if args.batteries is not None else [self.app.battery]
+        batch = self.app.evaluate_batch(batteries, sequences)
+        writer = RowWriter(self.output, args.format, (
+            "sequence", "description", "states", "energy", "max_power", "duration", "battery",
+            "lifetime_s", "end_capacity", "cycles_to_empty", "power_violation"
+        ))
+        for index, sequence in enumerate(sequences):
+            profile = sequence.get_profile()
+            for column, battery in enumerate(batteries):
+                writer.write_row((
+                    sequence.get_name(),
+                    sequence.get_description(),
+                    len(sequence.states),
+                    profile.get_energy(),
+                    profile.get_max_power(),
+                    profile.get_total_time(),
+                    battery.get_name(),
+                    self.app.get_lifetime(sequence, battery),
+                    float(batch.end_capacity[index, column]),
+                    float(batch.cycles_to_empty[index, column]),
+                    bool(batch.power_violation[index, column])
+                ))
+        writer.close()
+
+    def command_validate(self, args):
+        issues = [("error", file_path, message) for file_path, message in self.app.load_report.errors]
+        for element in self.app.loaded_elts:
+            for power_state in POWER_STATES:
+                if element.get_power(power_state) < 0 or element.get_time(power_state) < 0:
+                    issues.append(("error", element.get_name(), f"Negative power or time in {power_state}"))
+        max_output_power = self.app.battery.get_max_output_power()
+        for sequence in self.get_sequences(args.sequence):
+            for state in sequence.states:
+                if not state.elements:
+                    issues.append(("warning", sequence.get_name(), f"State {state.get_name()} has no element"))
+                for elt in state.elements:
+                    if isinstance(elt["element"], DummyElement):
+                        issues.append(("error", sequence.get_name(), f"State {state.get_name()} uses a missing element: {elt['element'].get_saved_name()}"))
+            if max_output_power > 0 and sequence.get_profile().get_max_power() > max_output_power:
+                issues.append(("warning", sequence.get_name(), "Peak power above the battery max output power"))
+        writer = RowWriter(self.output, args.format, ("level", "object", "message"))
+        writer.write_rows(issues)
+        writer.close()
+        return 1 if any(level == "error" for level, _, _ in issues) else 0
+
+    def command_jobs(self, args):
+        element_dicts = [element.to_dict() for element in self.app.loaded_elts]
+        resolve_sequence = lambda name: json.loads(self.app.dict_seqs.get_raw(name))
+        if args.input == "-":
+            run_jobs(sys.stdin, self.output, element_dicts, self.app.battery.to_dict(), resolve_sequence, args.workers, args.window)
+        else:
+            with open(args.input, "r") as file:
+                run_jobs(file, self.output, element_dicts, self.app.battery.to_dict(), resolve_sequence, args.workers, args.window)
+
+class RowWriter:
+    """
+    Write rows to a stream as a json list of objects or as csv, without keeping them
+    """
+    def __init__(self, output, output_format: str, fieldnames: tuple):
+        if output_format not in FORMATS:
+            raise ValueError(f"Invalid format: {output_format}")
+        self.output = output
+        self.format = output_format
+        self.fieldnames = fieldnames
+        self.count = 0
+        if self.format == "csv":
+            self.writer = csv.writer(output, lineterminator="\n")
+            self.writer.writerow(fieldnames)
+        else:
+            self.output.write("[")
+
+    def write_row(self, row):
+        self.write_rows([row])
+
+    def write_rows(self, rows):
+        if self.format == "csv":
+            for row in rows:
+                self.writer.writerow(row)
+                self.count += 1
+            return
+        for row in rows:
+            self.output.write(",\n" if self.count > 0 else "\n")
+            self.output.write(json.dumps({field: _json_value(value) for field, value in zip(self.fieldnames, row)}))
+            self.count += 1
+
+    def close(self):
+        if self.format == "json":
+            self.output.write("\n]\n" if self.count > 0 else "]\n")
+        self.output.flush()
+
+# Function
+#===========================================================================
+def _json_value(value):
+    """
+    Infinite and nan numbers are not valid json, they are written as null
+    """
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="main.py --no-gui", description="Run simulations without GUI")
+    commands = parser.add_subparsers(dest="command")
+
+    def add_command(name: str, help: str, sequences: bool=True):
+        command = commands.add_parser(name, help=help)
+        command.add_argument("--format", choices=FORMATS, default="json", help="Output format (default: %(default)s)")
+        if sequences:
+            command.add_argument("--sequence", action="append", default=None,
+                                 help="Sequence to use, repeat for several, default is every sequence")
+        return command
+
+    simulate_command = add_command("simulate", "Segments of sequences repeated on the battery")
+    simulate_command.add_argument("--cycles", type=int, default=1, help="Number of repetitions of each sequence (default: %(default)s)")
+    add_command("lifetime", "Battery lifetime of sequences")
+    sweep_command = add_command("sweep", "Lifetime of a sequence over battery parameters and element overrides", sequences=False)
+    sweep_command.add_argument("--sequence", required=True, help="Sequence to sweep")
+    sweep_command.add_argument("--capacity", type=float, nargs="+", default=None, help="Battery capacities, default is the battery capacity")
+    sweep_command.add_argument("--efficiency", type=float, nargs="+", default=None, help="Battery efficiencies, default is the battery efficiency")
+    sweep_command.add_argument("--input-power", dest="input_power", type=float, nargs="+", default=None,
+                               help="Battery input powers, default is the battery input power")
+    sweep_command.add_argument("--override", nargs=4, action="append", metavar=("ELEMENT", "STATE", "FIELD", "VALUES"),
+                               help="Comma separated values of an element power state field (power or time)")
+    sweep_command.add_argument("--workers", type=int, default=None, help="Number of worker processes, 1 runs in this process")
+    sweep_command.add_argument("--output", default=None, help="Also save the columns to a compressed numpy file (.npz), read by sweep.load_sweep")
+    report_command = add_command("report", "Energy, peak power, duration, lifetime and battery checks of sequences")
+    report_command.add_argument("--batteries", default=None,
+                                help="Battery catalog, a json list of batteries, one row per sequence and battery (default: the project battery)")
+    add_command("validate", "Files not loaded, missing elements and invalid values")
+    jobs_command = commands.add_parser("jobs", help="Run json lines jobs, one json result line per job")
+    jobs_command.add_argument("--input", default="-", help="Jobs file, - is stdin (default: %(default)s)")
+    jobs_command.add_argument("--workers", type=int, default=None, help="Number of worker processes, 1 runs in this process")
+    jobs_command.add_argument("--window", type=int, default=MAX_IN_FLIGHT, help="Maximum number of jobs in flight (default: %(default)s)")
+    return parser
+
+def print_lifetimes(app: App):
+    """
+    Print the battery lifetime of every loaded sequence
+    """
+    for name, lifetime in app.get_lifetimes().items():
+        if math.isinf(lifetime):
+            print(f"{name}: never depleted")
+        else:
+            print(f"{name}: {lifetime/SECONDS_PER_DAY:.2f} days ({lifetime:.0f} s)")
@@ -0,0 +1,150 @@
+# File: database.py
+"""
+This file contains the SQLite store of the element library
+
+Each element is one row of the elements table, with one column per
+(power state, power or time) pair. The name and every power/time column are indexed,
+so queries like "all parts with Active power < 5 mW sorted by Sleep power"
+and paging through the library do not read the whole library.
+
+A filter is a tuple (power state, "power" or "time", operator, value), for example
+("Active", "power", "<", 5e-3). Column names never come from user strings,
+they are picked among the known columns.
+
+"""
+
+from src.logger import logger
+from src.element_library import POWER_STATES, FIELDS
+from src.loader import load_directory
+import json
+import sqlite3
+
+OPERATORS = ("<", "<=", ">", ">=", "=", "!=")
+COLUMNS = tuple(f"{power_state.lower()}_{field}" for power_state in POWER_STATES for field in FIELDS)
+
+class ElementDatabase:
+    def __init__(self, file_path: str=":memory:"):
+        self.file_path = file_path
+        self.connection = sqlite3.connect(file_path)
+        self.connection.row_factory = sqlite3.Row
+        self.__create_tables()
+
+    def __create_tables(self):
+        columns = ", ".join(f"{column} REAL NOT NULL" for column in COLUMNS)
+        with self.connection:
+            self.connection.execute(
+                f"CREATE TABLE IF NOT EXISTS elements (name TEXT PRIMARY KEY, description TEXT NOT NULL, {columns}, tolerances TEXT)"
+            )
+            # name is indexed by its primary key
+            for column in COLUMNS:
+                self.connection.execute(f"CREATE INDEX IF NOT EXISTS elements_{column} ON elements ({column})")
+
+    def close(self):
+        self.connection.close()
+
+    # Getters
+    #===========================================================================
+    def get(self, name: str):
+        """
+        Returns the element dict (as Element.to_dict) of name, None if it is not stored
+        """
+        row = self.connection.execute("SELECT * FROM elements WHERE name = ?", (name,)).fetchone()
+        return None if row is None else _row_to_dict(row)
+
+    def count(self, filters: list=None):
+        where, parameters = _where(filters)
+        return self.connection.execute(f"SELECT COUNT(*) FROM elements {where}", parameters).fetchone()[0]
+
+    def __select(self, columns: str, filters: list, sort: tuple, descending: bool, limit: int, offset: int):
+        where, parameters = _where(filters)
+        order = "name" if sort is None else get_column(*sort)
+        direction = "DESC" if descending else "ASC"
+        sql = f"SELECT {columns} FROM elements {where} ORDER BY {order} {direction}, name LIMIT ? OFFSET ?"
+        return self.connection.execute(sql, parameters + [-1 if limit is None else int(limit), int(offset)])
+
+    def query(self, filters: list=None, sort: tuple=None, descending: bool=False, limit: int=None, offset: int=0):
+        """
+        Returns the element dicts matching every filter
+        sort is (power state, "power" or "time"), None sorts by name
+        """
+        return [_row_to_dict(row) for row in self.__select("*", filters, sort, descending, limit, offset)]
+
+    # Setters
+    #===========================================================================
+    def import_elements(self, dict_elements: list):
+        """
+        Insert or replace element dicts (as Element.to_dict) in one transaction
+        """
+        placeholders = ", ".join("?" for _ in range(len(COLUMNS) + 3))
+        with self.connection:
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO elements (name, description, {', '.join(COLUMNS)}, tolerances) VALUES ({placeholders})",
+                (_dict_to_row(dict_element) for dict_element in dict_elements)
+            )
+        logger.info(f"{len(dict_elements)} elements imported in {self.file_path}")
+
+    def import_directory(self, path: str):
+        """
+        Import every element json file of a directory in one transaction, returns the LoadReport
+        """
+        dict_elements, report = load_directory(path, _check_element)
+        self.import_elements(dict_elements)
+        return report
+
+    def remove(self, name: str):
+        with self.connection:
+            self.connection.execute("DELETE FROM elements WHERE name = ?", (name,))
+
+# Function
+#===========================================================================
+def get_column(power_state: str, field: str):
+    """
+    Returns the column of a power state field, raise a ValueError for an unknown one
+    """
+    column = f"{str(power_state).lower()}_{field}"
+    if column not in COLUMNS:
+        raise ValueError(f"Invalid column: {power_state} {field}")
+    return column
+
+def _where(filters: list=None):
+    """
+    Returns the WHERE clause of filters and its parameters
+    """
+    if not filters:
+        return "", []
+    clauses = []
+    parameters = []
+    for power_state, field, operator, value in filters:
+        if operator not in OPERATORS:
+            raise ValueError(f"Invalid operator: {operator}")
+        clauses.append(f"{get_column(power_state, field)} {operator} ?")
+        parameters.append(float(value))
+    return "WHERE " + " AND ".join(clauses), parameters
+
+def _check_element(dict_element: dict):
+    """
+    Raise a KeyError if an element dict misses a field, returns it
+    """
+    _dict_to_row(dict_element)
+    return dict_element
+
+def _dict_to_row(dict_element: dict):
+    values = []
+    tolerances = {}
+    for power_state in POWER_STATES:
+        dict_power_state = dict_element[f"{power_state}State"]
+        values += [dict_power_state["power"], dict_power_state["time"]]
+        for field in FIELDS:
+            if dict_power_state.get(f"{field}_tolerance") is not None:
+                tolerances.setdefault(power_state, {})[field] = dict_power_state[f"{field}_tolerance"]
+    return [dict_element["name"], dict_element["description"]] + values + [json.dumps(tolerances) if tolerances else None]
+
+def _row_to_dict(row: sqlite3.Row):
+    tolerances = json.loads(row["tolerances"]) if row["tolerances"] else {}
+    dict_element = {"name": row["name"], "description": row["description"]}
+    for power_state in POWER_STATES:
+        dict_power_state = {field: row[get_column(power_state, field)] for field in FIELDS}
+        for field, tolerance in tolerances.get(power_state, {}).items():
+            dict_power_state[f"{field}_tolerance"] = tolerance
+        dict_element[f"{power_state}State"] = dict_power_state
+    return dict_element
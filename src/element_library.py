@@ -0,0 +1,147 @@
+# File: element_library.py
+"""
+This file contains the array backed storage of elements
+
+Power and time of every element are stored in (n_elements x n_modes) float64 tables,
+an element is an integer id (a row) and a power state is a mode code (a column).
+Element and PowerState objects are thin views over these tables,
+so whole library queries are vectorized.
+
+"""
+
+import numpy as np
+import weakref
+
+POWER_STATES = ("Wake", "Active", "Fall", "Sleep")
+MODE_CODES = {name: code for code, name in enumerate(POWER_STATES)}
+FIELDS = ("power", "time")
+
+INITIAL_CAPACITY = 64
+
+def get_mode_code(power_state: str):
+    """
+    Returns the column of a power state name
+    """
+    try:
+        return MODE_CODES[power_state]
+    except KeyError:
+        raise ValueError("Invalid power_state")
+
+class ElementLibrary:
+    def __init__(self, capacity: int=INITIAL_CAPACITY):
+        capacity = max(int(capacity), 1)
+        self.power = np.zeros((capacity, len(POWER_STATES))) # in Watts
+        self.time = np.zeros((capacity, len(POWER_STATES))) # in seconds
+        self.mode_versions = np.zeros((capacity, len(POWER_STATES)), dtype=np.int64)
+        self.versions = np.zeros(capacity, dtype=np.int64)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.names = [None]*capacity
+        self.descriptions = [""]*capacity
+        self.tolerances = {} # {(id, mode code): {"power": dict, "time": dict}}, only for set tolerances
+        self.dependents = {} # {id: WeakSet of states}, only for used elements
+        self.free_ids = []
+        self.size = 0 # Number of rows ever used
+
+    # Rows
+    #===========================================================================
+    def get_capacity(self):
+        return self.power.shape[0]
+
+    def __grow(self):
+        capacity = self.get_capacity()
+        self.power = np.concatenate((self.power, np.zeros_like(self.power)))
+        self.time = np.concatenate((self.time, np.zeros_like(self.time)))
+        self.mode_versions = np.concatenate((self.mode_versions, np.zeros_like(self.mode_versions)))
+        self.versions = np.concatenate((self.versions, np.zeros_like(self.versions)))
+        self.alive = np.concatenate((self.alive, np.zeros_like(self.alive)))
+        self.names += [None]*capacity
+        self.descriptions += [""]*capacity
+
+    def allocate(self, name=None, description: str=""):
+        """
+        Returns the id of a new row, all values at 0
+        """
+        if self.free_ids:
+            element_id = self.free_ids.pop()
+        else:
+            if self.size >= self.get_capacity():
+                self.__grow()
+            element_id = self.size
+            self.size += 1
+        self.power[element_id] = 0
+        self.time[element_id] = 0
+        self.alive[element_id] = True
+        self.names[element_id] = name
+        self.descriptions[element_id] = description
+        return element_id
+
+    def release(self, element_id: int):
+        """
+        Free a row, it may be given to a new element
+        """
+        if not self.alive[element_id]:
+            return
+        self.alive[element_id] = False
+        self.names[element_id] = None
+        self.descriptions[element_id] = ""
+        self.dependents.pop(element_id, None)
+        for code in range(len(POWER_STATES)):
+            self.tolerances.pop((element_id, code), None)
+        self.free_ids.append(element_id)
+
+    # Values
+    #===========================================================================
+    def set_power(self, element_id: int, mode: int, power: float):
+        self.power[element_id, mode] = power
+        self.mode_versions[element_id, mode] += 1
+        self.versions[element_id] += 1
+
+    def set_time(self, element_id: int, mode: int, time: float):
+        self.time[element_id, mode] = time
+        self.mode_versions[element_id, mode] += 1
+        self.versions[element_id] += 1
+
+    def get_tolerance(self, element_id: int, mode: int, field: str):
+        return self.tolerances.get((element_id, mode), {}).get(field)
+
+    def set_tolerance(self, element_id: int, mode: int, field: str, tolerance: dict=None):
+        tolerances = self.tolerances.setdefault((element_id, mode), {})
+        if tolerance is None:
+            tolerances.pop(field, None)
+        else:
+            tolerances[field] = tolerance
+        if not tolerances:
+            del self.tolerances[(element_id, mode)]
+        self.versions[element_id] += 1
+
+    def get_dependents(self, element_id: int):
+        """
+        Returns the WeakSet of states using an element
+        """
+        if element_id not in self.dependents:
+            self.dependents[element_id] = weakref.WeakSet()
+        return self.dependents[element_id]
+
+    # Queries
+    #===========================================================================
+    def select(self, power_state: str, field: str="power", low: float=None, high: float=None):
+        """
+        Returns the ids of the elements with low <= value < high
+        for the field ("power" or "time") of a power state
+        """
+        if field not in FIELDS:
+            raise ValueError("Invalid field")
+        table = self.power if field == "power" else self.time
+        values = table[:self.size, get_mode_code(power_state)]
+        mask = self.alive[:self.size].copy()
+        if low is not None:
+            mask &= values >= low
+        if high is not None:
+            mask &= values < high
+        return np.flatnonzero(mask)
+
+    def get_names(self, element_ids):
+        return [self.names[element_id] for element_id in element_ids]
+
+# Library used by elements created without one
+default_library = ElementLibrary()
@@ -5,28 +5,41 @@ for example a accelerometer, a gyroscope, a sensor, a processor, etc.
 
 names must be unique
 
+An Element is a view over one row of an ElementLibrary, see element_library.py
+
 """
 
 from src.power_state import *
+from src.element_library import ElementLibrary, default_library, get_mode_code, POWER_STATES
+from src.atomic_file import BatchWriter, write_atomic
 import json
 
+DUMMY_PREFIX = "DummyElement_"
+
 class Element:
+    __slots__ = ("library", "id", "__weakref__")
+
     def __init__(self,
         name=None,
         wake:tuple[float, float] = (0, 0),
         active:tuple[float, float] = (0, 0),
         fall:tuple[float, float] = (0, 0),
         sleep:tuple[float, float] = (0, 0),
-        description:str = ""
+        description:str = "",
+        library: ElementLibrary = None
     ):
 
-        self.name = name
-        self.description = description
-        self.WakeState = PowerState(wake[0], wake[1])
-        self.ActiveState = PowerState(active[0], active[1])
-        self.FallState = PowerState(fall[0], fall[1])
-        self.SleepState = PowerState(sleep[0], sleep[1])
-        
+        self.library = library if library is not None else default_library
+        self.id = self.library.allocate(name, description)
+        self.library.power[self.id] = (wake[0], active[0], fall[0], sleep[0])
+        self.library.time[self.id] = (wake[1], active[1], fall[1], sleep[1])
+
+    def __del__(self):
+        try:
+            self.library.release(self.id)
+        except (AttributeError, TypeError):
+            pass # Interrupted __init__ or interpreter shutdown
+
     def __str__(self):
         string = (
             f"{self.name}"
@@ -37,66 +50,86 @@ class Element:
             f"{self.SleepState}"
         )
         return string
-    
+
+    # Row fields
+    #===========================================================================
+    @property
+    def name(self):
+        return self.library.names[self.id]
+
+    @name.setter
+    def name(self, name):
+        self.library.names[self.id] = name
+        self.library.versions[self.id] += 1
+        if self.id in self.library.dependents:
+            # States save the element by name
+            for state in list(self.dependents):
+                state.content_changed()
+
+    @property
+    def description(self):
+        return self.library.descriptions[self.id]
+
+    @description.setter
+    def description(self, description):
+        self.library.descriptions[self.id] = description
+        self.library.versions[self.id] += 1
+
+    @property
+    def version(self):
+        """
+        Incremented on each change of the element, used to save only changed elements
+        """
+        return int(self.library.versions[self.id])
+
+    @property
+    def dependents(self):
+        """
+        States using this element
+        """
+        return self.library.get_dependents(self.id)
+
+    @property
+    def WakeState(self):
+        return power_state_view(self, 0)
+
+    @property
+    def ActiveState(self):
+        return power_state_view(self, 1)
+
+    @property
+    def FallState(self):
+        return power_state_view(self, 2)
+
+    @property
+    def SleepState(self):
+        return power_state_view(self, 3)
+
     # Getters
     #===========================================================================
     def get_time(self, power_state: str):
-        match power_state:
-            case "Wake":
-                return self.WakeState.get_time()
-            case "Active":
-                return self.ActiveState.get_time()
-            case "Fall":
-                return self.FallState.get_time()
-            case "Sleep":
-                return self.SleepState.get_time()
-            case _:
-                raise ValueError("Invalid power_state")
+        return float(self.library.time[self.id, get_mode_code(power_state)])
 
     def get_power(self, power_state: str):
-        match power_state:
-            case "Wake":
-                return self.WakeState.get_power()
-            case "Active":
-                return self.ActiveState.get_power()
-            case "Fall":
-                return self.FallState.get_power()
-            case "Sleep":
-                return self.SleepState.get_power()
-            case _:
-                raise ValueError("Invalid power_state")
-    
+        return float(self.library.power[self.id, get_mode_code(power_state)])
+
     def get_name(self):
         return self.name
 
+    def get_saved_name(self):
+        """
+        Returns the name under which sequences save this element
+        """
+        return self.name
+
     def get_description(self):
         return self.description
 
     def str_power_state(self, power_state: str):
-        match power_state:
-            case "Wake":
-                return str(self.WakeState)
-            case "Active":
-                return str(self.ActiveState)
-            case "Fall":
-                return str(self.FallState)
-            case "Sleep":
-                return str(self.SleepState)
-            case _:
-                raise ValueError("Invalid power_state")
-    
+        return str(self.get_power_state(power_state))
+
     def get_power_state(self, power_state: str):
-        match power_state:
-            case "Wake":
-                return self.WakeState
-            case "Active":
-                return self.ActiveState
-            case "Fall":
-                return self.FallState
-            case "Sleep":
-                return self.SleepState
-            case _:
-                raise ValueError("Invalid power_state")
+        return power_state_view(self, get_mode_code(power_state))
 
     # Setters
     #===========================================================================
@@ -106,27 +139,47 @@ class Element:
     def set_name(self, name:str):
         self.name = str(name)
 
+    def set_from_dict(self, dict_element: dict):
+        """
+        Update the element in place from a dict of to_dict, states using it are notified
+        """
+        self.name = dict_element["name"]
+        self.description = dict_element["description"]
+        for mode, name in enumerate(POWER_STATES):
+            dict_power_state = dict_element[f"{name}State"]
+            power_state = power_state_view(self, mode)
+            power_state.set_power_tolerance(dict_power_state.get("power_tolerance"))
+            power_state.set_time_tolerance(dict_power_state.get("time_tolerance"))
+            power_state.set_power(dict_power_state["power"])
+            power_state.set_time(dict_power_state["time"])
+
     def edit_power_state(self,
         power_state: str,
         power: float = 0,
         time: float = 0
         ):
 
-        match power_state:
-            case "Wake":
-                self.WakeState.set_power(power)
-                self.WakeState.set_time(time)
-            case "Active":
-                self.ActiveState.set_power(power)
-                self.ActiveState.set_time(time)
-            case "Fall":
-                self.FallState.set_power(power)
-                self.FallState.set_time(time)
-            case "Sleep":
-                self.SleepState.set_power(power)
-                self.SleepState.set_time(time)
-            case _:
-                raise ValueError("Invalid power_state")
+        power_state = self.get_power_state(power_state)
+        power_state.set_power(power)
+        power_state.set_time(time)
+
+    # Dependencies
+    #===========================================================================
+    def add_dependent(self, state):
+        self.dependents.add(state)
+
+    def remove_dependent(self, state):
+        self.dependents.discard(state)
+
+    def power_state_changed(self, mode: int):
+        """
+        Called by a power state view when it changes
+        Notify the states using this element
+        """
+        if self.id not in self.library.dependents:
+            return
+        for state in list(self.dependents):
+            state.element_changed(self, POWER_STATES[mode])
 
     def to_dict(self):
         return {
@@ -143,18 +196,31 @@ class Element:
     def __from_dict(self, dict_element: dict):
         self.name = dict_element["name"]
         self.description = dict_element["description"]
-        self.WakeState = PowerState.from_dict(dict_element["WakeState"])
-        self.ActiveState = PowerState.from_dict(dict_element["ActiveState"])
-        self.FallState = PowerState.from_dict(dict_element["FallState"])
-        self.SleepState = PowerState.from_dict(dict_element["SleepState"])
-    
-    def to_json(self, path: str):
-        file_path = f"{path}/{self.name}.json"
-        with open(file_path, "w") as file:
-            file.write(json.dumps(self.to_dict(), indent=4))
-            
-    def from_dict(self, dict_element: dict):
-        element = Element()
+        for mode, name in enumerate(POWER_STATES):
+            dict_power_state = dict_element[f"{name}State"]
+            self.library.power[self.id, mode] = dict_power_state["power"]
+            self.library.time[self.id, mode] = dict_power_state["time"]
+            self.library.set_tolerance(self.id, mode, "power", dict_power_state.get("power_tolerance"))
+            self.library.set_tolerance(self.id, mode, "time", dict_power_state.get("time_tolerance"))
+
+    def get_file_name(self):
+        return f"{self.name}.json"
+
+    def to_json(self, path: str, writer: BatchWriter = None):
+        """
+        Write the element to path/name.json, atomically
+        With a writer, the file is written when the writer commits
+        """
+        file_path = f"{path}/{self.get_file_name()}"
+        content = json.dumps(self.to_dict(), indent=4)
+        if writer is None:
+            write_atomic(file_path, content)
+        else:
+            writer.write(file_path, content)
+        return file_path
+
+    def from_dict(self, dict_element: dict, library: ElementLibrary = None):
+        element = Element(library=library)
         element.__from_dict(dict_element)
         return element
 
@@ -164,17 +230,25 @@ class Element:
 def from_json(path: str):
     with open(path, "r") as file:
         dict_element = json.load(file)
-        return Element.from_dict(dict_element)
+        return Element.from_dict(None, dict_element)
 
 # Dummy element
 #===========================================================================
 class DummyElement(Element):
+    __slots__ = ()
+
     def __init__(self, name: str):
         super().__init__(
-            name=f"DummyElement_{name}",
+            name=f"{DUMMY_PREFIX}{name}",
             wake=(0, 0),
             active=(0, 0),
             fall=(0, 0),
             sleep=(0, 0),
             description="This is a dummy element"
         )
+
+    def get_saved_name(self):
+        """
+        Returns the name of the missing element, so saving keeps the reference
+        """
+        return self.name[len(DUMMY_PREFIX):]
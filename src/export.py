@@ -0,0 +1,66 @@
+# File: export.py
+"""
+This file contains the fixed rate export of power profiles
+
+The piecewise-constant profile of a sequence, optionally repeated, is sampled
+at t = i/sample_rate. Samples are produced in chunks of chunk_size by resample,
+so exporting a billion samples uses the same memory as exporting a thousand.
+
+Exports are:
+    csv         time,power lines
+    binary      raw little-endian power samples, the time of a sample is its index/sample_rate
+
+"""
+
+from src.logger import logger
+import numpy as np
+
+CHUNK_SAMPLES = 1 << 16
+BINARY_DTYPE = "<f4"
+
+# Function
+#===========================================================================
+def get_sample_count(profile, sample_rate: float, n_repeat: int=1):
+    """
+    Returns the number of samples of a profile repeated n_repeat times
+    """
+    if sample_rate <= 0:
+        raise ValueError(f"Invalid sample rate: {sample_rate}")
+    return int(np.ceil(profile.get_total_time()*n_repeat*sample_rate))
+
+def resample(profile, sample_rate: float, n_repeat: int=1, chunk_size: int=CHUNK_SAMPLES):
+    """
+    Generator of (times, powers) arrays of at most chunk_size samples
+    """
+    n_samples = get_sample_count(profile, sample_rate, n_repeat)
+    cycle_time = profile.get_total_time()
+    padded_power = np.concatenate((profile.power, [0]))
+    for first in range(0, n_samples, chunk_size):
+        times = np.arange(first, min(first + chunk_size, n_samples))/sample_rate
+        index = np.searchsorted(profile.end, np.fmod(times, cycle_time), side="right")
+        yield times, padded_power[index]
+
+def export_csv(file_path: str, profile, sample_rate: float, n_repeat: int=1, chunk_size: int=CHUNK_SAMPLES):
+    """
+    Write the samples of a profile to a csv file, returns the number of samples
+    """
+    n_samples = 0
+    with open(file_path, "w") as file:
+        file.write("time,power\n")
+        for times, powers in resample(profile, sample_rate, n_repeat, chunk_size):
+            np.savetxt(file, np.column_stack((times, powers)), fmt="%.9g", delimiter=",")
+            n_samples += times.size
+    logger.info(f"{n_samples} samples exported to {file_path}")
+    return n_samples
+
+def export_binary(file_path: str, profile, sample_rate: float, n_repeat: int=1, dtype: str=BINARY_DTYPE, chunk_size: int=CHUNK_SAMPLES):
+    """
+    Write the power samples of a profile as raw dtype values, returns the number of samples
+    """
+    n_samples = 0
+    with open(file_path, "wb") as file:
+        for _, powers in resample(profile, sample_rate, n_repeat, chunk_size):
+            file.write(powers.astype(dtype).tobytes())
+            n_samples += powers.size
+    logger.info(f"{n_samples} samples exported to {file_path}")
+    return n_samples
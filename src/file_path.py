@@ -7,6 +7,8 @@ This file contains the path to the files
 data_path = "data/"
 elements_path = data_path + "elements/"
 sequences_path = data_path + "sequences/"
+cache_path = data_path + "cache/"
 
 # Files paths
-battery_file = data_path + "battery.json"
\ No newline at end of file
+battery_file = data_path + "battery.json"
+database_file = data_path + "elements.sqlite"
\ No newline at end of file
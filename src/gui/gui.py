@@ -15,6 +15,7 @@ from src.state import State
 from src.elements import Element
 from src.power_state import PowerState
 from src.battery import Battery
+from src.power_profile import PowerProfile
 
 # Matplotlib
 from matplotlib.figure import Figure
@@ -49,15 +50,17 @@ POWER_STATE_COLOR = {
 }
 
 GRAPH_ECH = 1000
+ELEMENT_PAGE_SIZE = 50 # Elements shown at once in the element pannel
+RELOAD_INTERVAL = 2000 # Milliseconds between two polls of the data directories
 
 # customtkinter appearance
 customtkinter.set_appearance_mode("System")
 customtkinter.set_default_color_theme("green")
 
 class GUI(customtkinter.CTk):
-    def __init__(self, app: App = App()):
+    def __init__(self, app: App = None):
         super().__init__()
-        self.app = app
+        self.app = app if app is not None else App()
         # Configure windows
         #================================
         self.geometry(f"{WINDOWS_WIDTH}x{WINDOWS_HEIGHT}")
@@ -86,9 +89,32 @@ class GUI(customtkinter.CTk):
         #================================
         self.__pannel_element = PannelElement(self, self.app)
         self.__pannel_element.grid(row=0, column=2, rowspan=2, sticky="senw", padx=2)
+
+        # Hot reload
+        #================================
+        self.after(RELOAD_INTERVAL, self.reload_changes)
     
     # Methods
     #================================
+    def reload_changes(self):
+        """
+        Reload the files changed on disk and refresh only the pannels they affect
+        """
+        element_changes, sequence_changes = self.app.reload_changes()
+        if not element_changes.is_empty():
+            self.__pannel_element.refresh_elements(element_changes.changed)
+        if not sequence_changes.is_empty():
+            self.__SequencePannel.update_selection()
+        current_sequence = self.app.current_sequence
+        used_elements = set()
+        if current_sequence is not None:
+            used_elements = {elt["element"].get_name() for state in current_sequence.states for elt in state.elements}
+        if (current_sequence is not None and current_sequence.name in sequence_changes.changed) or used_elements & (element_changes.changed | element_changes.removed):
+            self.update_scrollable_states()
+            self.update_graph()
+            self.update_state_spinbox()
+        self.after(RELOAD_INTERVAL, self.reload_changes)
+
     def update_state_spinbox(self): #Dirty
         self.__battery.update_state_spinbox()
 
@@ -140,12 +166,21 @@ class AppGUIInterface:
     def get_max_time(self) -> float:
         return self.app.get_max_time()
 
+    def get_app_profile(self) -> PowerProfile:
+        return self.app.get_profile()
+
     # Elements
     def get_app_list_elements(self) -> list[Element]:
         return self.app.loaded_elts
 
     def get_app_element(self, name: str) -> Element:
         return self.app.dict_elts[name]
+
+    def get_app_element_page(self, page: int, page_size: int=ELEMENT_PAGE_SIZE) -> list[Element]:
+        return self.app.get_element_page(page, page_size)
+
+    def get_app_element_count(self) -> int:
+        return self.app.get_element_count()
     
     # Battery
     def get_app_battery(self) -> Battery:
@@ -259,11 +294,21 @@ class PannelElement(customtkinter.CTkFrame, AppGUIInterface):
         #================================
         self.__scrollable_elements = PannelScrollableElement(self, app=self.app)
         self.__scrollable_elements.grid(row=1, column=0, sticky="nsew")
+        self.__header.update_page(self.__scrollable_elements.get_page(), self.__scrollable_elements.get_page_count())
 
     # Methods
     #================================
     def update_scrollable_elements(self):
         self.__scrollable_elements.update_scrollable_elements()
+        self.__header.update_page(self.__scrollable_elements.get_page(), self.__scrollable_elements.get_page_count())
+
+    def change_page(self, step: int):
+        self.__scrollable_elements.change_page(step)
+        self.update_scrollable_elements()
+
+    def refresh_elements(self, names: set):
+        self.__scrollable_elements.refresh_elements(names)
+        self.update_scrollable_elements()
 
 class PannelHeaderElement(customtkinter.CTkFrame, AppGUIInterface):
     def __init__(self, master, app: App=None):
@@ -284,6 +329,17 @@ class PannelHeaderElement(customtkinter.CTkFrame, AppGUIInterface):
                                         )
         self.name.grid(row=0, column=0)
 
+        # Page selection
+        #================================
+        self.page_frame = customtkinter.CTkFrame(self)
+        self.page_frame.grid(row=0, column=1)
+        self.previous_button = customtkinter.CTkButton(self.page_frame, text="<", width=30, command=lambda: self.master.change_page(-1))
+        self.previous_button.grid(row=0, column=0)
+        self.page_label = customtkinter.CTkLabel(self.page_frame, text="", padx=10)
+        self.page_label.grid(row=0, column=1)
+        self.next_button = customtkinter.CTkButton(self.page_frame, text=">", width=30, command=lambda: self.master.change_page(1))
+        self.next_button.grid(row=0, column=2)
+
         # Add create element button
         #================================
         self.add_button = customtkinter.CTkButton(self, text="Add element", command=self.create_element)
@@ -291,6 +347,9 @@ class PannelHeaderElement(customtkinter.CTkFrame, AppGUIInterface):
 
     # Methods
     #================================
+    def update_page(self, page: int, page_count: int):
+        self.page_label.configure(text=f"{page+1}/{page_count}")
+
     def create_element(self):
         logger.debug("Creating new element")
         WinCreateElement(self, self.app)
@@ -301,7 +360,8 @@ class PannelScrollableElement(customtkinter.CTkScrollableFrame, AppGUIInterface)
         AppGUIInterface.__init__(self, app)
         # Attributes
         #================================
-        self.__elt_list = self.get_app_list_elements()
+        self.__page = 0
+        self.__elt_list = self.get_app_element_page(self.__page)
         self.__elt_frames: list[FrameElement] = []
         self.__PADX = 2
         self.__PADY = 2
@@ -324,14 +384,40 @@ class PannelScrollableElement(customtkinter.CTkScrollableFrame, AppGUIInterface)
                 self.__elt_frames.append(elt_frame)
             
     def remove_obsolete_element(self):
-        for frame in self.__elt_frames:
+        for frame in list(self.__elt_frames):
             if frame.get_name() not in [elt.get_name() for elt in self.__elt_list]:
                 frame.destroy()
                 self.__elt_frames.remove(frame)
 
     def update_scrollable_elements(self):
+        self.__page = min(self.__page, self.get_page_count()-1)
+        self.__elt_list = self.get_app_element_page(self.__page)
         self.remove_obsolete_element()
         self.add_hidden_element()
+        for row, frame in enumerate(self.__elt_frames):
+            frame.grid(row=row, column=0, padx=self.__PADX, pady=self.__PADY, sticky="nsew")
+
+    def change_page(self, step: int):
+        self.__page = max(0, min(self.__page + step, self.get_page_count()-1))
+
+    def refresh_elements(self, names: set):
+        """
+        Rebuild the frames of the elements in names, the other frames are kept
+        """
+        for index, frame in enumerate(self.__elt_frames):
+            if frame.get_name() in names:
+                elt_name = frame.get_name()
+                frame.destroy()
+                self.__elt_frames[index] = FrameElement(self, self.app, elt_name=elt_name)
+                self.__elt_frames[index].grid(row=index, column=0, padx=self.__PADX, pady=self.__PADY, sticky="nsew")
+
+    # Getters
+    #================================
+    def get_page(self) -> int:
+        return self.__page
+
+    def get_page_count(self) -> int:
+        return max(1, -(-self.get_app_element_count()//ELEMENT_PAGE_SIZE))
 
 class FrameElement(customtkinter.CTkFrame, AppGUIInterface):
     def __init__(self, master, app: App=None, elt_name: int=None, **kwargs):
@@ -518,7 +604,7 @@ class WinCreateElement(customtkinter.CTkToplevel, AppGUIInterface):
 
         # Create element frame
         #===========================================================================
-        self.frame_create_element_sub = CreateElementSub(self, element=self.element)
+        self.frame_create_element_sub = CreateElementSub(self, element=self.element, app=self.app)
         self.frame_create_element_sub.grid(row=0, column=0, columnspan=2, sticky="nsew")
         
         # Cancel button
@@ -548,7 +634,12 @@ class WinCreateElement(customtkinter.CTkToplevel, AppGUIInterface):
 
     def save(self):
         logger.debug("Saving element")
-        self.frame_create_element_sub.save()
+        try:
+            self.frame_create_element_sub.save()
+        except ValueError as error:
+            self.frame_create_element_sub.name_warning()
+            logger.error(error)
+            return
         if not self.element.get_name() == "":
             self.app.add_element(self.element)
             self.master.master.update_scrollable_elements()
@@ -558,13 +649,14 @@ class WinCreateElement(customtkinter.CTkToplevel, AppGUIInterface):
             logger.error("Element name is empty")
 
 class CreateElementSub(customtkinter.CTkFrame):
-    def __init__(self, master, element=None, **kwargs):
+    def __init__(self, master, element=None, app: App=None, **kwargs):
         if element is None:
             raise ValueError("Element must be provided")
         customtkinter.CTkFrame.__init__(self, master)
         # Attributes
         #===========================================================================
         self.element = element
+        self.app = app
         PADX = 2
         PADY = 2
 
@@ -621,7 +713,16 @@ class CreateElementSub(customtkinter.CTkFrame):
     #===========================================================================
     def save(self):
         logger.debug("Saving element")
-        self.element.set_name(self.name.get())
+        name = self.name.get()
+        if self.app is None or name == self.element.get_name():
+            self.element.set_name(name)
+        elif self.app.dict_elts.get(self.element.get_name()) is self.element:
+            # Loaded element, sequences and indexes follow the new name
+            self.app.rename_element(self.element, name)
+        elif name in self.app.dict_elts:
+            raise ValueError(f"Element {name} already exists")
+        else:
+            self.element.set_name(name)
         self.element.set_description(self.description.get(1.0, "end"))
 
     def name_warning(self):
@@ -658,6 +759,9 @@ class PannelSequence(customtkinter.CTkFrame, AppGUIInterface):
     #================================
     def update_scrollable_state(self):
         self.__scrollable_frame.update_scrollable_state()
+
+    def update_selection(self):
+        self.__selection_frame.update_selection()
     
 class PannelScrollableSequence(customtkinter.CTkScrollableFrame, AppGUIInterface):
     def __init__(self, master, app: App=None):
@@ -1081,7 +1185,7 @@ class WinCreateState(customtkinter.CTkToplevel, AppGUIInterface):
         if not name == "":
             self.state = self.create_app_state()
             self.state.set_name(name)
-            self.state.elements = self.elements_choice.save()
+            self.state.set_elements(self.elements_choice.save())
             self.state.set_description(self.description.get(1.0, "end"))
 
             self.get_app_current_sequence().add_state(self.state)
@@ -1309,27 +1413,13 @@ class GraphWithPlot(customtkinter.CTkFrame, AppGUIInterface):
     # Methods
     #================================
     def update_graph(self):
-        self.y, self.t = self.generate_power_data()
-        logger.debug(f"y: {self.y}, t: {self.t}")
-        logger.debug(f"y: {self.y}, t: {self.t}")
-        self.max_lenght = self.get_max_time()
+        profile = self.get_app_profile()
+        self.max_lenght = profile.get_total_time()
         self.x_disp = np.linspace(0, self.max_lenght, GRAPH_ECH)
-        self.y_disp = []
-        self.__fig = Figure(figsize=(7, 4), dpi=100)
-        self.current_state = 0
-        for x in self.x_disp:
-            self.y_disp.append(self.y[self.current_state])
-            if x >= self.t[self.current_state]:
-                if self.current_state < len(self.t)-1:
-                    self.current_state += 1
+        self.y_disp = profile.power_at(self.x_disp)
         # Battery plot
         self.batt_init_cap = self.app.battery.current_capacity
-        self.y_batt = [self.batt_init_cap]
-        for cons in self.y_disp[1:]:
-            if cons >= 0:
-                self.y_batt.append(self.y_batt[-1] - cons*self.max_lenght/GRAPH_ECH)
-            else:
-                self.y_batt.append(self.y_batt[-1])
+        self.y_batt = self.batt_init_cap - self.app.battery.net_energy(profile.energy_at(self.x_disp), self.x_disp)
         self.__fig = Figure(figsize=(7, 4), dpi=100)
         self.plot1 = self.__fig.add_subplot(111)
         self.plot1.plot(self.x_disp, self.y_disp, 'b', label="Consumption")
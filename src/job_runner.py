@@ -0,0 +1,161 @@
+# File: job_runner.py
+"""
+This file contains the json lines job runner
+
+Each input line is a job:
+    {
+        "id": any value copied to the result, default is the line number,
+        "sequence": name of a project sequence, or a sequence dict as saved in data/sequences,
+        "battery": fields replacing those of the project battery (Battery.to_dict schema),
+                   a battery with a new capacity and no current_capacity starts full,
+        "elements": {element name: fields replacing those of the project element (Element.to_dict schema)}
+    }
+Each job gives one result line, in input order:
+    {"id", "sequence", "energy", "max_power", "duration", "lifetime", "end_capacity", "cycles_to_empty", "power_violation"}
+    or {"id", "error"} when the job is invalid.
+
+Jobs run on a process pool. The project elements and battery are sent once to each worker,
+at most `window` jobs are in flight, so memory does not depend on the number of jobs.
+
+"""
+
+from src.logger import logger
+from src.sequence import Sequence
+from src.elements import Element
+from src.battery import Battery
+from src.batch import get_cycle_peak, get_cycles_to_empty
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import json
+import math
+
+MAX_IN_FLIGHT = 256
+
+# Project elements and battery of the worker process, set by _init_worker
+_base_elements = {}
+_base_battery = {}
+
+# Function
+#===========================================================================
+def run_jobs(lines, output, element_dicts: list, battery_dict: dict, resolve_sequence=None, max_workers: int=None, window: int=MAX_IN_FLIGHT):
+    """
+    Run the jobs of lines (an iterable of json strings) and write one result line per job to output
+    resolve_sequence(name) returns the dict of a project sequence
+    max_workers=1 runs in the current process, returns the number of jobs
+    """
+    jobs = (_prepare_job(line_number, line, resolve_sequence) for line_number, line in enumerate(lines, 1) if line.strip())
+    count = 0
+    if max_workers == 1:
+        _init_worker(element_dicts, battery_dict)
+        for job in jobs:
+            _write_result(output, run_job(job))
+            count += 1
+        logger.info(f"{count} jobs run")
+        return count
+
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(element_dicts, battery_dict)) as executor:
+        pending = deque()
+        for job in jobs:
+            pending.append(executor.submit(run_job, job))
+            if len(pending) >= window:
+                _write_result(output, pending.popleft().result())
+                count += 1
+        while pending:
+            _write_result(output, pending.popleft().result())
+            count += 1
+    logger.info(f"{count} jobs run")
+    return count
+
+def run_job(job: dict):
+    """
+    Run a job prepared by _prepare_job, returns its result dict
+    """
+    if "error" in job:
+        return job
+    try:
+        dict_sequence = job["sequence"]
+        element_overrides = job.get("elements") or {}
+        dict_elts = {}
+        for name in _get_element_names(dict_sequence):
+            if name not in _base_elements and name not in element_overrides:
+                raise ValueError(f"Unknown element: {name}")
+            dict_element = _merge(_base_elements.get(name, {"name": name}), element_overrides.get(name, {}))
+            dict_elts[name] = Element.from_dict(None, dict_element)
+        sequence = Sequence.from_dict(None, dict_sequence, dict_elts)
+        battery = Battery.from_dict(None, _merge_battery(_base_battery, job.get("battery") or {}))
+
+        # Invalid values (efficiency 0, a string power, ...) only fail here
+        profile = sequence.get_profile()
+        cycle_net = float(battery.net_energy(profile.get_energy(), profile.get_total_time()))
+        cycle_peak = get_cycle_peak(profile, battery.get_efficiency(), battery.get_input_power())
+        return {
+            "id": job["id"],
+            "sequence": sequence.get_name(),
+            "energy": profile.get_energy(),
+            "max_power": profile.get_max_power(),
+            "duration": profile.get_total_time(),
+            "lifetime": battery.lifetime(profile),
+            "end_capacity": battery.get_current_capacity() - cycle_net,
+            "cycles_to_empty": get_cycles_to_empty(battery.get_current_capacity(), cycle_net, cycle_peak),
+            "power_violation": profile.get_max_power() > battery.get_max_output_power()
+        }
+    except (ArithmeticError, KeyError, TypeError, ValueError, AttributeError) as error:
+        return {"id": job["id"], "error": f"{type(error).__name__}: {error}"}
+
+def _prepare_job(line_number: int, line: str, resolve_sequence=None):
+    """
+    Parse a job line and replace a sequence name by its dict
+    """
+    try:
+        job = json.loads(line)
+    except ValueError as error:
+        return {"id": line_number, "error": f"{type(error).__name__}: {error}"}
+    if not isinstance(job, dict):
+        return {"id": line_number, "error": "ValueError: A job must be a json object"}
+    job.setdefault("id", line_number)
+    try:
+        if isinstance(job.get("sequence"), str):
+            if resolve_sequence is None:
+                raise ValueError("Sequences must be given as dicts")
+            job["sequence"] = resolve_sequence(job["sequence"])
+        elif not isinstance(job.get("sequence"), dict):
+            raise ValueError("A job needs a sequence name or dict")
+    except (KeyError, ValueError) as error:
+        return {"id": job["id"], "error": f"{type(error).__name__}: {error}"}
+    return job
+
+def _init_worker(element_dicts: list, battery_dict: dict):
+    global _base_elements, _base_battery
+    _base_elements = {dict_element["name"]: dict_element for dict_element in element_dicts}
+    _base_battery = battery_dict
+
+def _get_element_names(dict_sequence: dict):
+    return {dict_elt["element"] for dict_state in dict_sequence["states"] for dict_elt in dict_state["list_elements"]}
+
+def _merge(base: dict, override: dict):
+    """
+    Returns base with the fields of override, nested dicts are merged
+    """
+    merged = dict(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+def _merge_battery(base: dict, override: dict):
+    """
+    Returns base with the fields of override, current_capacity defaults to an overridden capacity
+    """
+    if "capacity" in override and "current_capacity" not in override:
+        override = dict(override, current_capacity=override["capacity"])
+    return _merge(base, override)
+
+def _write_result(output, result: dict):
+    """
+    Infinite numbers are not valid json, they are written as null
+    """
+    result = {key: None if isinstance(value, float) and not math.isfinite(value) else value for key, value in result.items()}
+    output.write(json.dumps(result) + "\n")
+    output.flush()
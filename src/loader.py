@@ -0,0 +1,88 @@
+# File: loader.py
+"""
+This file contains the loader of the per-file layout (one json file per object)
+
+Files are listed with os.scandir and read on a thread pool. The main thread
+parses them in order while the next ones are read. At most max_pending reads
+are in flight, so memory stays bounded on very large directories.
+A file that can not be read or parsed is reported and skipped.
+
+"""
+
+from src.logger import logger
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import json
+import os
+
+MAX_WORKERS = 8
+MAX_PENDING = 64
+
+class LoadReport:
+    def __init__(self):
+        self.loaded = 0
+        self.files = [] # Paths of the loaded files, in load order
+        self.errors = [] # [(file path, error message)]
+
+    def __str__(self):
+        return f"{self.loaded} files loaded, {len(self.errors)} errors"
+
+    def add_error(self, file_path: str, error: Exception):
+        self.errors.append((file_path, f"{type(error).__name__}: {error}"))
+        logger.error(f"Can not load {file_path}: {error}")
+
+    def has_errors(self):
+        return len(self.errors) > 0
+
+    def merge(self, report):
+        self.loaded += report.loaded
+        self.files += report.files
+        self.errors += report.errors
+        return self
+
+# Function
+#===========================================================================
+def scan_json(path: str, exclude: tuple=()):
+    """
+    Returns the sorted paths of the json files of a directory, except the file names in exclude
+    """
+    with os.scandir(path) as entries:
+        return sorted(entry.path for entry in entries if entry.name.endswith(".json") and entry.name not in exclude and entry.is_file())
+
+def _read(file_path: str):
+    with open(file_path, "rb") as file:
+        return file.read()
+
+def load_directory(path: str, parse, max_workers: int=MAX_WORKERS, max_pending: int=MAX_PENDING, exclude: tuple=()):
+    """
+    Returns the list of parse(dict) for every json file of path, and a LoadReport
+    """
+    loaded, report = load_files(scan_json(path, exclude), parse, max_workers, max_pending)
+    logger.debug(f"{path}: {report}")
+    return loaded, report
+
+def load_files(file_paths: list, parse, max_workers: int=MAX_WORKERS, max_pending: int=MAX_PENDING):
+    """
+    Returns the list of parse(dict) for every json file of file_paths, and a LoadReport
+    """
+    report = LoadReport()
+    loaded = []
+    file_paths = iter(file_paths)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for file_path in file_paths:
+            pending.append((file_path, executor.submit(_read, file_path)))
+            if len(pending) >= max_pending:
+                break
+        while pending:
+            file_path, future = pending.popleft()
+            next_path = next(file_paths, None)
+            if next_path is not None:
+                pending.append((next_path, executor.submit(_read, next_path)))
+            try:
+                loaded.append(parse(json.loads(future.result())))
+                report.loaded += 1
+                report.files.append(file_path)
+            except (OSError, ValueError, KeyError, TypeError) as error:
+                report.add_error(file_path, error)
+    return loaded, report
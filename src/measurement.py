@@ -0,0 +1,215 @@
+# File: measurement.py
+"""
+This file contains the import of measured current traces into element power states
+
+A trace is a csv file of (time, current, voltage) rows, for example from a power analyzer.
+It is read in chunks of CHUNK_ROWS rows, so only one chunk of samples is in memory.
+
+Plateau detection:
+    samples are averaged over windows of `window` samples,
+    a plateau ends when a window mean differs from the previous one by more than
+    `threshold` (relative) and `min_step` (absolute).
+    A window across a step is merged into the following plateau.
+
+Power state proposal (two passes over the file, memory does not depend on its length):
+    pass 1 finds the lowest and highest plateau powers,
+    pass 2 classifies each plateau on a log10 power scale: Sleep near the lowest power,
+    Active near the highest, Wake between Sleep and Active, Fall between Active and Sleep.
+    Levels spread over decades (1 uW sleep, 1 mW wake, 10 mW active) stay apart.
+    The proposed power of a state is its mean power, its time the mean length of a visit.
+    The first and last plateaus are cut by the recording and are not counted.
+
+"""
+
+from src.logger import logger
+from src.element_library import POWER_STATES
+from itertools import islice
+import numpy as np
+
+CHUNK_ROWS = 1 << 18
+MIN_POWER = 1e-12 # Lower powers are taken as MIN_POWER on the log scale
+
+class PlateauDetector:
+    def __init__(self, window: int=16, threshold: float=0.1, min_step: float=1e-6):
+        self.window = window
+        self.threshold = threshold
+        self.min_step = min_step
+        self.remainder_time = np.zeros(0)
+        self.remainder_power = np.zeros(0)
+        self.last_mean = None
+        self.last_changed = False
+        self.open_plateau = None # (start time, sum of window means, window count)
+        self.end_time = None
+
+    # Methods
+    #===========================================================================
+    def feed(self, times, powers):
+        """
+        Add samples, returns the (starts, durations, powers) arrays of the plateaus completed
+        """
+        times = np.concatenate((self.remainder_time, times))
+        powers = np.concatenate((self.remainder_power, powers))
+        if times.size > 0:
+            self.end_time = float(times[-1])
+        n_windows = times.size//self.window
+        cut = n_windows*self.window
+        self.remainder_time = times[cut:]
+        self.remainder_power = powers[cut:]
+        if n_windows == 0:
+            return _empty_plateaus()
+
+        window_times = times[:cut:self.window]
+        window_means = powers[:cut].reshape(n_windows, self.window).mean(axis=1)
+        previous = np.concatenate(([window_means[0] if self.last_mean is None else self.last_mean], window_means[:-1]))
+        changed = np.abs(window_means - previous) > np.maximum(self.threshold*np.abs(previous), self.min_step)
+        # A window across a step differs from both neighbours, it starts the new plateau
+        previous_changed = np.concatenate(([self.last_changed], changed[:-1]))
+        self.last_changed = bool(changed[-1])
+        changed &= ~previous_changed
+        self.last_mean = window_means[-1]
+
+        starts = np.union1d([0], np.flatnonzero(changed))
+        sums = np.add.reduceat(window_means, starts)
+        counts = np.diff(np.append(starts, n_windows))
+        run_times = window_times[starts]
+        if self.open_plateau is not None:
+            open_start, open_sum, open_count = self.open_plateau
+            if changed[0]:
+                run_times = np.concatenate(([open_start], run_times))
+                sums = np.concatenate(([open_sum], sums))
+                counts = np.concatenate(([open_count], counts))
+            else:
+                run_times[0] = open_start
+                sums[0] += open_sum
+                counts[0] += open_count
+        self.open_plateau = (run_times[-1], sums[-1], counts[-1])
+        return run_times[:-1], np.diff(run_times), sums[:-1]/counts[:-1]
+
+    def finish(self):
+        """
+        Returns the last plateau, it ends with the last sample
+        """
+        if self.remainder_power.size > 0:
+            # Last partial window, kept in the last plateau
+            if self.open_plateau is None:
+                self.open_plateau = (self.remainder_time[0], 0.0, 0)
+            start, total, count = self.open_plateau
+            self.open_plateau = (start, total + self.remainder_power.mean(), count + 1)
+            self.remainder_time = np.zeros(0)
+            self.remainder_power = np.zeros(0)
+        if self.open_plateau is None:
+            return _empty_plateaus()
+        start, total, count = self.open_plateau
+        self.open_plateau = None
+        return np.array([start]), np.array([self.end_time - start]), np.array([total/count])
+
+# Function
+#===========================================================================
+def _empty_plateaus():
+    return np.zeros(0), np.zeros(0), np.zeros(0)
+
+def read_chunks(file_path: str, chunk_rows: int=CHUNK_ROWS, columns: tuple=(0, 1, 2), delimiter: str=","):
+    """
+    Generator of (times, powers) arrays of at most chunk_rows samples
+    columns are the indexes of the time, current and voltage columns
+    A header line is skipped
+    """
+    with open(file_path, "r") as file:
+        first_line = file.readline()
+        lines = [first_line] if _is_numeric(first_line, columns, delimiter) else []
+        while True:
+            lines += list(islice(file, chunk_rows - len(lines)))
+            lines = [line for line in lines if line.strip()]
+            if not lines:
+                return
+            data = np.loadtxt(lines, delimiter=delimiter, usecols=columns, ndmin=2)
+            yield data[:, 0], data[:, 1]*data[:, 2]
+            lines = []
+
+def _is_numeric(line: str, columns: tuple, delimiter: str):
+    values = line.split(delimiter)
+    try:
+        for column in columns:
+            float(values[column])
+    except (ValueError, IndexError):
+        return False
+    return True
+
+def iter_plateaus(file_path: str, window: int=16, threshold: float=0.1, min_step: float=1e-6, **read_options):
+    """
+    Generator of the (starts, durations, powers) arrays of the plateaus of a trace file
+    """
+    detector = PlateauDetector(window, threshold, min_step)
+    for times, powers in read_chunks(file_path, **read_options):
+        plateaus = detector.feed(times, powers)
+        if plateaus[0].size > 0:
+            yield plateaus
+    yield detector.finish()
+
+def get_log_power(power):
+    """
+    Returns log10 of power (scalar or array), powers below MIN_POWER are taken as MIN_POWER
+    """
+    log_power = np.log10(np.maximum(power, MIN_POWER))
+    return float(log_power) if np.ndim(log_power) == 0 else log_power
+
+def propose_power_states(file_path: str, tolerance: float=0.1, **detector_options):
+    """
+    Returns {power state: (power, time)} proposed from a trace file
+    tolerance is the part of the log10 power range around the lowest and highest power classified as Sleep and Active
+    States not seen in the trace are (0, 0)
+    """
+    low = np.inf
+    high = -np.inf
+    count = 0
+    for _, _, powers in iter_plateaus(file_path, **detector_options):
+        if powers.size > 0:
+            low = min(low, get_log_power(powers.min()))
+            high = max(high, get_log_power(powers.max()))
+            count += powers.size
+    if count == 0:
+        raise ValueError(f"No samples in {file_path}")
+
+    energies = dict.fromkeys(POWER_STATES, 0.0)
+    times = dict.fromkeys(POWER_STATES, 0.0)
+    visits = dict.fromkeys(POWER_STATES, 0)
+    sleep_limit = low + tolerance*(high - low)
+    active_limit = high - tolerance*(high - low)
+    last_level = "Sleep"
+    previous_state = None
+    index = 0
+    for starts, durations, powers in iter_plateaus(file_path, **detector_options):
+        for duration, power, log_power in zip(durations.tolist(), powers.tolist(), get_log_power(powers).tolist()):
+            if log_power <= sleep_limit:
+                power_state = last_level = "Sleep"
+            elif log_power >= active_limit:
+                power_state = last_level = "Active"
+            else:
+                power_state = "Wake" if last_level == "Sleep" else "Fall"
+            cut = count > 2 and (index == 0 or index == count - 1)
+            index += 1
+            if cut:
+                previous_state = power_state
+                continue
+            energies[power_state] += power*duration
+            times[power_state] += duration
+            if power_state != previous_state:
+                visits[power_state] += 1
+            previous_state = power_state
+
+    proposal = {}
+    for power_state in POWER_STATES:
+        if visits[power_state] == 0 or times[power_state] == 0:
+            proposal[power_state] = (0, 0)
+        else:
+            proposal[power_state] = (energies[power_state]/times[power_state], times[power_state]/visits[power_state])
+    logger.info(f"{count} plateaus found in {file_path}")
+    return proposal
+
+def apply_power_states(element, proposal: dict):
+    """
+    Set the power and time of the power states of an element from a proposal
+    """
+    for power_state, (power, time) in proposal.items():
+        element.edit_power_state(power_state, power, time)
+    return element
@@ -0,0 +1,154 @@
+# File: membership.py
+"""
+This file contains the compiled state membership of a sequence
+
+The (state, element power state) memberships of a sequence are stored as a
+CSR sparse matrix: row i lists the cells (element id * number of modes + mode code)
+of the ElementLibrary used by state i. Values are read from the library tables
+on each evaluation, so editing an element needs no rebuild, only a new product.
+
+"""
+
+from src.element_library import default_library, get_mode_code, POWER_STATES
+from src.power_profile import PowerProfile
+import numpy as np
+
+COMPILE_CELLS = 1 << 22 # Size of the (states x memberships per state) table compiled at once
+
+class MembershipMatrix:
+    def __init__(self, indptr: np.ndarray, indices: np.ndarray, library=None):
+        self.indptr = np.asarray(indptr, dtype=np.int64) # Row i is indices[indptr[i]:indptr[i+1]]
+        self.indices = np.asarray(indices, dtype=np.int64) # Flat cells of the library tables
+        self.library = library if library is not None else default_library
+        counts = np.diff(self.indptr)
+        self.rows = np.repeat(np.arange(counts.size), counts) # State of each membership
+        self.columns = np.arange(self.indices.size) - self.indptr[self.rows] # Position in its state
+
+    # Getters
+    #===========================================================================
+    def get_state_count(self):
+        return self.indptr.size - 1
+
+    def get_membership_count(self):
+        return self.indices.size
+
+    def get_width(self):
+        """
+        Returns the largest number of memberships of a state
+        """
+        return int(self.columns.max()) + 1 if self.columns.size > 0 else 0
+
+    def get_values(self):
+        """
+        Returns the power and time of every membership, read from the library
+        """
+        return self.library.power.ravel()[self.indices], self.library.time.ravel()[self.indices]
+
+    # Methods
+    #===========================================================================
+    def __reduce_rows(self, ufunc, values: np.ndarray):
+        """
+        Reduce the values of each row, empty rows are 0
+        """
+        result = np.zeros(self.get_state_count())
+        non_empty = np.flatnonzero(np.diff(self.indptr) > 0)
+        if non_empty.size > 0:
+            result[non_empty] = ufunc.reduceat(values, self.indptr[non_empty])
+        return result
+
+    def evaluate(self):
+        """
+        Returns the peak power, energy and duration of each state
+        """
+        powers, times = self.get_values()
+        return (
+            self.__reduce_rows(np.add, powers),
+            self.__reduce_rows(np.add, powers*times),
+            self.__reduce_rows(np.maximum, times)
+        )
+
+    def compile(self) -> PowerProfile:
+        """
+        Compile the power profile of every state at once, same segments as State.compile()
+        Memberships are sorted by end time inside each state, the power of a segment is
+        the sum of the memberships still running
+        """
+        profile = PowerProfile()
+        if self.get_state_count() > 0:
+            profile.set_segments(*self.compile_segments(), self.indptr)
+        return profile
+
+    def compile_segments(self):
+        """
+        Returns the durations and powers of the segments of every state, in membership order
+        """
+        powers, times = self.get_values()
+        order = np.lexsort((times, self.rows))
+        powers, times = powers[order], times[order]
+
+        previous = np.zeros(times.size)
+        previous[1:] = times[:-1]
+        durations = np.where(self.columns > 0, times - previous, times)
+
+        # Suffix sums of each row, padded rows keep the summation order of State.compile()
+        padded = np.zeros((self.get_state_count(), self.get_width()))
+        padded[self.rows, self.columns] = powers
+        suffix = np.cumsum(padded[:, ::-1], axis=1)[:, ::-1]
+        return durations, suffix[self.rows, self.columns]
+
+# Function
+#===========================================================================
+def compile_memberships(memberships: list):
+    """
+    Returns the PowerProfile of each MembershipMatrix, same profiles as MembershipMatrix.compile()
+    Matrices of a same library are stacked and compiled together, about COMPILE_CELLS at once
+    """
+    profiles = [None]*len(memberships)
+    batches = {} # {library: [(index, membership)]}
+    for index, membership in enumerate(memberships):
+        batches.setdefault(id(membership.library), []).append((index, membership))
+    for batch in batches.values():
+        first = 0
+        while first < len(batch):
+            last = first + 1
+            states = batch[first][1].get_state_count()
+            width = batch[first][1].get_width()
+            while last < len(batch) and (states + batch[last][1].get_state_count())*max(width, batch[last][1].get_width()) <= COMPILE_CELLS:
+                states += batch[last][1].get_state_count()
+                width = max(width, batch[last][1].get_width())
+                last += 1
+            _compile_batch(batch[first:last], profiles)
+            first = last
+    return profiles
+
+def _compile_batch(batch: list, profiles: list):
+    """
+    Compile the stacked (index, membership) of batch, profiles[index] is set
+    """
+    offsets = np.cumsum([0] + [membership.get_membership_count() for _, membership in batch])
+    indptr = np.concatenate([[0]] + [membership.indptr[1:] + offset for (_, membership), offset in zip(batch, offsets)])
+    indices = np.concatenate([membership.indices for _, membership in batch])
+    stacked = MembershipMatrix(indptr, indices, batch[0][1].library)
+    durations, powers = stacked.compile_segments() if stacked.get_state_count() > 0 else (np.zeros(0), np.zeros(0))
+    for (index, membership), first, last in zip(batch, offsets[:-1], offsets[1:]):
+        profiles[index] = PowerProfile()
+        profiles[index].set_segments(durations[first:last], powers[first:last], membership.indptr)
+
+def build_membership(states: list):
+    """
+    Returns the MembershipMatrix of a list of states
+    All elements must be stored in the same library
+    """
+    library = None
+    indptr = [0]
+    indices = []
+    for state in states:
+        for elt in state.elements:
+            element = elt["element"]
+            if library is None:
+                library = element.library
+            elif element.library is not library:
+                raise ValueError("Elements of a sequence must be stored in the same library")
+            indices.append(element.id*len(POWER_STATES) + get_mode_code(elt["power_state"]))
+        indptr.append(len(indices))
+    return MembershipMatrix(indptr, indices, library)
@@ -0,0 +1,151 @@
+# File: network.py
+"""
+This file contains classes to simulate a whole sensor network
+
+A network is a set of nodes, each node runs a sequence in loop on its own battery.
+Nodes are simulated on a priority queue of events, battery depletion
+is solved analytically so the number of events does not depend on the
+number of cycles run by a node.
+
+"""
+
+from src.logger import logger
+from src.sequence import Sequence
+from src.battery import Battery
+import heapq
+import math
+import numpy as np
+
+SECONDS_PER_YEAR = 365*86400
+
+# Event kinds, ordered by priority when they happen at the same time
+EVENT_START = 0
+EVENT_DEPLETION = 1
+EVENT_HORIZON = 2
+
+class Node:
+    def __init__(self,
+        name=None,
+        sequence: Sequence=None,
+        battery: Battery=None,
+        phase: float=0.0, # Position in the sequence at start, in seconds
+        start_time: float=0.0 # Deployment time, in seconds
+        ):
+
+        if sequence is None:
+            raise ValueError("Sequence must be provided")
+        if battery is None:
+            raise ValueError("Battery must be provided")
+        self.name = str(name)
+        self.sequence = sequence
+        self.battery = battery
+        self.phase = phase
+        self.start_time = start_time
+        self.depletion_time = math.inf
+
+    def get_lifetime(self):
+        """
+        Returns the time the node runs on its battery
+        """
+        return self.battery.lifetime(self.sequence.get_profile(), phase=self.phase)
+
+class NetworkReport:
+    def __init__(self, names: list, depletion_times: np.ndarray, start_times: np.ndarray, horizon: float):
+        self.names = names
+        self.depletion_times = depletion_times # math.inf for nodes alive at horizon
+        self.lifetimes = depletion_times - start_times
+        self.horizon = horizon
+
+    def get_first_death(self):
+        """
+        Returns the name and depletion time of the first node to die
+        (None, math.inf) if no node died before horizon
+        """
+        if len(self.names) == 0 or np.isinf(self.depletion_times).all():
+            return None, math.inf
+        index = int(np.argmin(self.depletion_times))
+        return self.names[index], float(self.depletion_times[index])
+
+    def get_median_lifetime(self):
+        """
+        Returns the median lifetime of the nodes
+        math.inf if more than half of the nodes are alive at horizon
+        """
+        if len(self.names) == 0:
+            return math.inf
+        return float(np.median(self.lifetimes))
+
+    def get_alive_count(self):
+        return int(np.isinf(self.depletion_times).sum())
+
+    def to_dict(self):
+        name, time = self.get_first_death()
+        return {
+            "horizon": self.horizon,
+            "first_death": {"name": name, "time": time},
+            "median_lifetime": self.get_median_lifetime(),
+            "alive": self.get_alive_count(),
+            "depletion_times": dict(zip(self.names, self.depletion_times.tolist()))
+        }
+
+class Network:
+    def __init__(self, nodes: list=None):
+        self.nodes = nodes if nodes is not None else []
+
+    # Adding functions
+    #===========================================================================
+    def add_node(self, node: Node):
+        self.nodes.append(node)
+
+    def add_nodes(self,
+        count: int,
+        sequence: Sequence,
+        battery: Battery,
+        random_phase: bool=True,
+        seed: int=None
+        ):
+        """
+        Add count nodes running sequence, each one on a copy of battery
+        With random_phase, nodes start at a random position of the sequence
+        """
+        rng = np.random.default_rng(seed)
+        total_time = sequence.get_max_time()
+        phases = rng.uniform(0, total_time, count) if random_phase else np.zeros(count)
+        first = len(self.nodes)
+        for i, phase in enumerate(phases.tolist()):
+            node_battery = Battery().from_dict(battery.to_dict())
+            self.add_node(Node(name=f"{sequence.get_name()}_{first+i}", sequence=sequence, battery=node_battery, phase=phase))
+
+    # Methods
+    #===========================================================================
+    def simulate(self, horizon: float=SECONDS_PER_YEAR):
+        """
+        Run the network until horizon (in seconds)
+        Returns a NetworkReport
+        """
+        events = [(node.start_time, EVENT_START, i) for i, node in enumerate(self.nodes)]
+        events.append((horizon, EVENT_HORIZON, -1))
+        heapq.heapify(events)
+        depletion_times = np.full(len(self.nodes), math.inf)
+        n_dead = 0
+
+        while events:
+            time, kind, index = heapq.heappop(events)
+            if kind == EVENT_HORIZON:
+                break
+            node = self.nodes[index]
+            if kind == EVENT_START:
+                depletion = time + node.get_lifetime()
+                if depletion <= horizon:
+                    heapq.heappush(events, (depletion, EVENT_DEPLETION, index))
+            elif kind == EVENT_DEPLETION:
+                depletion_times[index] = time
+                if n_dead == 0:
+                    logger.info(f"First node depleted: {node.name} at {time} s")
+                n_dead += 1
+
+        for node, depletion in zip(self.nodes, depletion_times.tolist()):
+            node.depletion_time = depletion
+        logger.info(f"{n_dead}/{len(self.nodes)} nodes depleted before {horizon} s")
+        start_times = np.array([node.start_time for node in self.nodes], dtype=float)
+        return NetworkReport([node.name for node in self.nodes], depletion_times, start_times, horizon)
@@ -0,0 +1,190 @@
+# File: power_profile.py
+"""
+This file contains class to represent the compiled power profile of a sequence
+
+The profile is a piecewise-constant power consumption stored as contiguous
+numpy arrays (start time, duration, power). It is built once from the
+State/Element objects and read by every consumer (battery stepping, graphs, ...)
+
+"""
+
+import numpy as np
+
+# Number of battery configurations for which net energy arrays are kept
+NET_CACHE_SIZE = 64
+
+class PowerProfile:
+    def __init__(self,
+        state_durations: list = [],
+        state_powers: list = []
+        ):
+        """
+        state_durations and state_powers contains one array per state,
+        as returned by State.compile()
+        """
+        lengths = [len(durations) for durations in state_durations]
+        self.state_offsets = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)))
+        self.raw_duration = np.concatenate(state_durations) if lengths else np.zeros(0)
+        self.raw_power = np.concatenate(state_powers) if lengths else np.zeros(0)
+        self.__merge()
+
+    def set_segments(self, raw_duration: np.ndarray, raw_power: np.ndarray, state_offsets: np.ndarray):
+        """
+        Replace all the raw segments, the segments of state i are state_offsets[i]:state_offsets[i+1]
+        """
+        self.raw_duration = np.asarray(raw_duration, dtype=float)
+        self.raw_power = np.asarray(raw_power, dtype=float)
+        self.state_offsets = np.array(state_offsets, dtype=np.int64)
+        self.__merge()
+
+    def update_states(self, updates: dict):
+        """
+        Replace the raw segments of some states, updates is {state index: (durations, powers)}
+        Segments are written in place when the number of segments of a state is unchanged
+        """
+        if not updates:
+            return
+        for index, (durations, powers) in updates.items():
+            first, last = self.state_offsets[index], self.state_offsets[index+1]
+            if len(durations) == last - first:
+                self.raw_duration[first:last] = durations
+                self.raw_power[first:last] = powers
+            else:
+                self.raw_duration = np.concatenate((self.raw_duration[:first], durations, self.raw_duration[last:]))
+                self.raw_power = np.concatenate((self.raw_power[:first], powers, self.raw_power[last:]))
+                self.state_offsets[index+1:] += len(durations) - (last - first)
+        self.__merge()
+
+    def __merge(self):
+        """
+        Build the merged arrays from the raw segments of each state
+        Zero length segments are dropped and adjacent equal power segments are merged
+        """
+        cumulated_time = np.concatenate(([0], np.cumsum(self.raw_duration)))
+        cumulated_energy = np.concatenate(([0], np.cumsum(self.raw_duration*self.raw_power)))
+        self.state_end = cumulated_time[self.state_offsets[1:]]
+        self.state_energy = cumulated_energy[self.state_offsets[1:]]
+        # Taken before zero length segments are dropped, elements all start at the beginning of a state
+        self.max_power = float(self.raw_power.max()) if self.raw_power.size > 0 else 0
+        self.__net_cache = {}
+
+        keep = self.raw_duration > 0
+        durations = self.raw_duration[keep]
+        powers = self.raw_power[keep]
+        if durations.size == 0:
+            self.start = np.zeros(0)
+            self.duration = np.zeros(0)
+            self.power = np.zeros(0)
+            self.end = np.zeros(0)
+            self.cum_energy = np.zeros(1)
+            return
+        first = np.concatenate(([0], np.flatnonzero(np.diff(powers) != 0) + 1))
+        self.duration = np.add.reduceat(durations, first)
+        self.power = np.ascontiguousarray(powers[first])
+        self.end = np.cumsum(self.duration)
+        self.start = self.end - self.duration
+        self.start[0] = 0
+        # Energy consumed at the start of each segment, last value is the total
+        self.cum_energy = np.concatenate(([0], np.cumsum(self.power*self.duration)))
+
+    # Getters
+    #===========================================================================
+    def get_max_power(self):
+        """
+        Returns the maximum power of the profile
+        """
+        return self.max_power
+
+    def get_total_time(self):
+        """
+        Returns the total duration of the profile
+        """
+        return float(self.state_end[-1]) if self.state_end.size > 0 else 0
+
+    def get_energy(self):
+        """
+        Returns the energy consumption of the profile
+        """
+        return float(self.cum_energy[-1])
+
+    def get_state_energy(self, index: int):
+        """
+        Returns the energy consumed from the beginning up to the end of state index
+        """
+        return float(self.state_energy[index])
+
+    def get_state_end(self, index: int):
+        """
+        Returns the time at which state index ends
+        """
+        return float(self.state_end[index])
+
+    def get_state_count(self):
+        return len(self.state_offsets) - 1
+
+    def power_at(self, time):
+        """
+        Returns the power at time (scalar or array)
+        Power is 0 after the end of the profile
+        """
+        time = np.asarray(time, dtype=float)
+        index = np.searchsorted(self.end, time, side="right")
+        padded = np.concatenate((self.power, [0]))
+        return padded[index]
+
+    def energy_at(self, time):
+        """
+        Returns the energy consumed from the beginning up to time (scalar or array)
+        """
+        time = np.clip(np.asarray(time, dtype=float), 0, self.get_total_time())
+        index = np.minimum(np.searchsorted(self.end, time, side="right"), self.power.size)
+        padded_power = np.concatenate((self.power, [0]))
+        padded_start = np.concatenate((self.start, [self.get_total_time()]))
+        return self.cum_energy[index] + padded_power[index]*(time - padded_start[index])
+
+    def get_net_energy(self, efficiency: float=100, input_power: float=0):
+        """
+        Returns the energy drawn from a battery at the end of each segment,
+        and its running maximum.
+        Arrays are kept for the last NET_CACHE_SIZE efficiencies and input powers asked
+        """
+        key = (efficiency, input_power)
+        if key not in self.__net_cache:
+            if len(self.__net_cache) >= NET_CACHE_SIZE:
+                del self.__net_cache[next(iter(self.__net_cache))]
+            net_energy = self.cum_energy[1:]*(100/efficiency) - input_power*self.end
+            net_peak = np.maximum.accumulate(net_energy) if self.end.size > 0 else self.end
+            self.__net_cache[key] = (net_energy, net_peak)
+        return self.__net_cache[key]
+
+    def to_power_data(self):
+        """
+        Returns the power of each segment and the time at which it ends
+        """
+        return self.power, self.end
+
+    def to_arrays(self):
+        """
+        Returns the raw segments of the profile, rebuilt by profile_from_arrays
+        """
+        return {"raw_duration": self.raw_duration, "raw_power": self.raw_power, "state_offsets": self.state_offsets}
+
+# Function
+#===========================================================================
+def compile_sequence(sequence):
+    """
+    Compile a sequence into a PowerProfile
+    """
+    compiled_states = [state.compile() for state in sequence.states]
+    return PowerProfile(
+        state_durations=[durations for durations, _ in compiled_states],
+        state_powers=[powers for _, powers in compiled_states]
+    )
+
+def profile_from_arrays(arrays: dict):
+    """
+    Build a PowerProfile from the arrays of PowerProfile.to_arrays
+    """
+    profile = PowerProfile()
+    profile.set_segments(np.array(arrays["raw_duration"], dtype=float), np.array(arrays["raw_power"], dtype=float), arrays["state_offsets"])
+    return profile
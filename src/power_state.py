@@ -1,51 +1,122 @@
 # File: power_state.py
 """
 This file contains class to represent power state of a device
+
+A PowerState is a view over one cell of an ElementLibrary (element row, mode column),
+see element_library.py. A PowerState created on its own gets its own row
+in the default library.
 """
 
+from src.element_library import default_library
+
 class PowerState:
-    def __init__(self, power: float = 0, time: float = 0):
-        self.power = power
-        self.time = time
-        
+    __slots__ = ("library", "id", "mode", "owner")
+
+    def __init__(self, power: float = 0, time: float = 0, power_tolerance: dict = None, time_tolerance: dict = None):
+        self.library = default_library
+        self.id = self.library.allocate()
+        self.mode = 0
+        self.owner = None # Element notified of changes, None when the power state has its own row
+        self.library.power[self.id, self.mode] = power
+        self.library.time[self.id, self.mode] = time
+        # Distribution around the typical value, see tolerance.py, None for an exact value
+        self.library.set_tolerance(self.id, self.mode, "power", power_tolerance)
+        self.library.set_tolerance(self.id, self.mode, "time", time_tolerance)
+
+    def __del__(self):
+        try:
+            if self.owner is None:
+                self.library.release(self.id)
+        except (AttributeError, TypeError):
+            pass # Interrupted __init__ or interpreter shutdown
+
     def __str__(self):
         string = (
-            f"Power {self.power} W for {self.time} s"
+            f"Power {self.get_power()} W for {self.get_time()} s"
         )
         return string
-    
+
     # Getters
     #===========================================================================
     def get_power(self):
-        return self.power
-        
+        return float(self.library.power[self.id, self.mode])
+
     def get_time(self):
-        return self.time
-        
+        return float(self.library.time[self.id, self.mode])
+
     def get_energy(self):
-        return self.power*self.time
-        
+        return self.get_power()*self.get_time()
+
+    def get_power_tolerance(self):
+        return self.library.get_tolerance(self.id, self.mode, "power")
+
+    def get_time_tolerance(self):
+        return self.library.get_tolerance(self.id, self.mode, "time")
+
+    def get_version(self):
+        return int(self.library.mode_versions[self.id, self.mode])
+
     # Setters
     #===========================================================================
     def set_power(self, power: float = 0):
-        self.power = power
-        
+        self.library.set_power(self.id, self.mode, power)
+        self.changed()
+
     def set_time(self, time: float = 0):
-        self.time = time
+        self.library.set_time(self.id, self.mode, time)
+        self.changed()
+
+    def set_power_tolerance(self, power_tolerance: dict = None):
+        self.library.set_tolerance(self.id, self.mode, "power", power_tolerance)
+
+    def set_time_tolerance(self, time_tolerance: dict = None):
+        self.library.set_tolerance(self.id, self.mode, "time", time_tolerance)
+
+    # Methods
+    #===========================================================================
+    def changed(self):
+        """
+        Notify the owner element, versions are incremented by the library
+        """
+        if self.owner is not None:
+            self.owner.power_state_changed(self.mode)
 
     # Save and load
     #===========================================================================
     def to_dict(self):
-        return {
-            "power": self.power,
-            "time": self.time
+        dict_power_state = {
+            "power": self.get_power(),
+            "time": self.get_time()
         }
-    
+        power_tolerance = self.get_power_tolerance()
+        time_tolerance = self.get_time_tolerance()
+        if power_tolerance is not None:
+            dict_power_state["power_tolerance"] = power_tolerance
+        if time_tolerance is not None:
+            dict_power_state["time_tolerance"] = time_tolerance
+        return dict_power_state
+
     def __from_dict(self, dict_power_state: dict):
-        self.power = dict_power_state["power"]
-        self.time = dict_power_state["time"]
-    
+        self.library.power[self.id, self.mode] = dict_power_state["power"]
+        self.library.time[self.id, self.mode] = dict_power_state["time"]
+        self.set_power_tolerance(dict_power_state.get("power_tolerance"))
+        self.set_time_tolerance(dict_power_state.get("time_tolerance"))
+
     def from_dict(dict_power_state: dict):
         power_state = PowerState()
         power_state.__from_dict(dict_power_state)
-        return power_state
\ No newline at end of file
+        return power_state
+
+# Function
+#===========================================================================
+def power_state_view(owner, mode: int):
+    """
+    Returns the PowerState of the mode column of an element row
+    The view keeps the element alive, the row belongs to the element
+    """
+    power_state = PowerState.__new__(PowerState)
+    power_state.library = owner.library
+    power_state.id = owner.id
+    power_state.mode = mode
+    power_state.owner = owner
+    return power_state
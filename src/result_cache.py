@@ -0,0 +1,247 @@
+# File: result_cache.py
+"""
+This file contains the on-disk cache of simulation results
+
+An entry is a directory named after the sha256 of everything the result depends on:
+the kind of result, the content hash of Sequence.to_dict() and of the elements it uses
+(or the arrays of the profile for a lifetime), Battery.to_dict() and the parameters
+of the computation. Element hashes are kept per element version, so an element used
+by many sequences is hashed once. Each array of the result
+is one .npy file. Sweep columns are loaded with numpy.load(mmap_mode="r"), so a large
+cached result is mapped instead of read, profiles are read since PowerProfile copies them.
+
+Only the sequences unchanged since they were loaded (see add_loaded) use the disk:
+the content hash of a sequence is computed once, its profile is read from the cache
+when it is first compiled. An edited sequence patches its profile in memory
+(Sequence.get_profile), which is far cheaper than hashing its content again.
+Stale entries are never read and are evicted by the size cap, least recently used first.
+
+"""
+
+from src.logger import logger
+from src.file_path import cache_path
+from src.power_profile import profile_from_arrays
+from src.sweep import Sweep
+from src.sequence_index import get_content_hash, get_element_hash
+import hashlib
+import numpy as np
+import os
+import shutil
+import weakref
+
+CACHE_SIZE_LIMIT = 256*1024*1024 # In bytes
+
+class ResultCache:
+    def __init__(self, path: str=cache_path, max_size: int=CACHE_SIZE_LIMIT, hash_cache: weakref.WeakKeyDictionary=None):
+        self.path = path
+        self.max_size = max_size
+        self.size = None # Size on disk, scanned on first put
+        self.loaded_sequences = weakref.WeakKeyDictionary() # {sequence: (version when loaded, sequence hash, content hash)}
+        self.hash_cache = hash_cache if hash_cache is not None else weakref.WeakKeyDictionary() # {element: (version, content hash)}
+
+    # Getters
+    #===========================================================================
+    def get_key(self, kind: str, sequence=None, battery=None, parameters=None, profile=None):
+        """
+        Returns the key of a result of a sequence, or of a profile for results that only depend on it
+        """
+        content = {
+            "kind": kind,
+            "sequence": None if sequence is None else self.get_content_hash(sequence),
+            "profile": None if profile is None else get_profile_hash(profile),
+            "battery": None if battery is None else battery.to_dict(),
+            "parameters": parameters
+        }
+        return get_content_hash(content)
+
+    def get_content_hash(self, sequence):
+        """
+        Returns the sha256 of a sequence and of the elements it uses
+        It is computed once for a sequence unchanged since it was loaded
+        """
+        version, sequence_hash, content_hash = self.loaded_sequences.get(sequence, (None, None, None))
+        unchanged = version == sequence.version
+        if unchanged and content_hash is not None:
+            return content_hash
+        if not unchanged or sequence_hash is None:
+            sequence_hash = get_content_hash(sequence.to_dict())
+        content = {
+            "sequence": sequence_hash,
+            "elements": [get_element_hash(element, self.hash_cache) for element in get_referenced_elements(sequence)]
+        }
+        content_hash = get_content_hash(content)
+        if unchanged:
+            self.loaded_sequences[sequence] = (version, sequence_hash, content_hash)
+        return content_hash
+
+    def is_unchanged(self, sequence):
+        """
+        True if the sequence was registered by add_loaded and did not change since
+        """
+        version, _, _ = self.loaded_sequences.get(sequence, (None, None, None))
+        return version == sequence.version
+
+    def get_size(self):
+        """
+        Returns the size of the cache on disk, in bytes
+        """
+        return sum(size for _, _, size in self.__scan())
+
+    def get(self, key: str, mmap: bool=True):
+        """
+        Returns the {name: array} of an entry, None if the entry is missing
+        With mmap, arrays are memory mapped instead of read
+        """
+        entry_path = os.path.join(self.path, key)
+        try:
+            file_names = os.listdir(entry_path)
+            arrays = {
+                os.path.splitext(file_name)[0]: np.load(os.path.join(entry_path, file_name), mmap_mode="r" if mmap else None)
+                for file_name in file_names if file_name.endswith(".npy")
+            }
+            os.utime(entry_path) # Last use, for the eviction
+        except (OSError, ValueError):
+            return None
+        return arrays
+
+    # Setters
+    #===========================================================================
+    def add_loaded(self, sequence, sequence_hash: str=None):
+        """
+        Register a sequence just loaded from a file, its results use the disk while it is unchanged
+        sequence_hash is get_content_hash(sequence.to_dict()) when the caller computed it already
+        """
+        self.loaded_sequences[sequence] = (sequence.version, sequence_hash, None)
+
+    def put(self, key: str, arrays: dict):
+        """
+        Store the {name: array} of an entry, then evict entries over the size cap
+        """
+        entry_path = os.path.join(self.path, key)
+        temporary_path = f"{entry_path}.tmp{os.getpid()}"
+        try:
+            os.makedirs(temporary_path, exist_ok=True)
+            for name, array in arrays.items():
+                np.save(os.path.join(temporary_path, f"{name}.npy"), np.asarray(array))
+            os.replace(temporary_path, entry_path)
+        except OSError:
+            # Stored meanwhile by another process, or not writable
+            shutil.rmtree(temporary_path, ignore_errors=True)
+            return
+        if self.size is None:
+            self.size = self.get_size()
+        else:
+            self.size += sum(entry.stat().st_size for entry in os.scandir(entry_path))
+        if self.size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in max_size
+        """
+        entries = sorted(self.__scan())
+        total = sum(size for _, _, size in entries)
+        for _, entry_path, size in entries:
+            if total <= self.max_size:
+                break
+            shutil.rmtree(entry_path, ignore_errors=True)
+            total -= size
+            logger.debug(f"Cache entry {os.path.basename(entry_path)} evicted")
+        self.size = total
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.size = 0
+
+    def __scan(self):
+        """
+        Returns the (last use, path, size) of each entry
+        """
+        entries = []
+        try:
+            directories = list(os.scandir(self.path))
+        except FileNotFoundError:
+            return entries
+        for directory in directories:
+            if not directory.is_dir() or ".tmp" in directory.name:
+                continue
+            size = sum(entry.stat().st_size for entry in os.scandir(directory.path))
+            entries.append((directory.stat().st_mtime_ns, directory.path, size))
+        return entries
+
+    # Results
+    #===========================================================================
+    def get_profile(self, sequence):
+        """
+        Returns the compiled profile of a sequence
+        The cache is only used to compile a sequence unchanged since it was loaded,
+        a profile compiled before is patched in memory by the sequence
+        """
+        if sequence.has_profile() or not self.is_unchanged(sequence):
+            return sequence.get_profile()
+        key = self.get_key("profile", sequence)
+        arrays = self.get(key, mmap=False)
+        if arrays is not None:
+            profile = profile_from_arrays(arrays)
+            sequence.set_profile(profile)
+            return profile
+        profile = sequence.get_profile()
+        self.put(key, profile.to_arrays())
+        return profile
+
+    def get_lifetime(self, sequence, battery):
+        """
+        Returns battery.lifetime of the profile of a sequence
+        The cache is only used for a sequence unchanged since it was loaded
+        """
+        profile = self.get_profile(sequence)
+        if not self.is_unchanged(sequence):
+            return battery.lifetime(profile)
+        key = self.get_key("lifetime", battery=battery, profile=profile)
+        arrays = self.get(key)
+        if arrays is not None and "lifetime" in arrays:
+            return float(arrays["lifetime"])
+        lifetime = battery.lifetime(profile)
+        self.put(key, {"lifetime": np.array(lifetime)})
+        return lifetime
+
+    def run_sweep(self, sweep: Sweep, max_workers: int=None):
+        """
+        Returns sweep.run(), the columns are memory mapped when they come from the cache
+        """
+        parameters = {
+            "capacities": list(sweep.capacities),
+            "efficiencies": list(sweep.efficiencies),
+            "input_powers": list(sweep.input_powers),
+            "overrides": [[list(key), list(values)] for key, values in sweep.overrides.items()]
+        }
+        key = self.get_key("sweep", sweep.sequence, parameters=parameters)
+        columns = self.get(key)
+        if columns:
+            return columns
+        columns = sweep.run(max_workers)
+        self.put(key, columns)
+        return columns
+
+# Function
+#===========================================================================
+def get_profile_hash(profile):
+    """
+    Returns the sha256 of the raw arrays of a profile
+    """
+    digest = hashlib.sha256()
+    for name, array in profile.to_arrays().items():
+        array = np.ascontiguousarray(array)
+        digest.update(f"{name}{array.dtype}{array.shape}".encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+def get_referenced_elements(sequence):
+    """
+    Returns the elements used by a sequence, sorted by name
+    """
+    elements = {}
+    for state in sequence.states:
+        for elt in state.elements:
+            elements[elt["element"].get_name()] = elt["element"]
+    return [elements[name] for name in sorted(elements)]
@@ -5,6 +5,9 @@ This file contains class to represent a sequence of states
 
 from src.state import State
 from src.elements import Element
+from src.power_profile import PowerProfile
+from src.membership import MembershipMatrix, build_membership
+from src.atomic_file import BatchWriter, write_atomic
 import json
 from src.logger import logger
 
@@ -12,15 +15,24 @@ class Sequence:
     def __init__(self,
         name=None,
         description: str = "",
-        states=[],
+        states=None,
         dict_elts=None
         ):
 
         self.name = str(name)
         self.description = str(description)
-        self.states = states
+        self.states = states if states is not None else []
         self.elements = None
         self.dict_elts = dict_elts
+        self.version = 0 # Incremented on each change of the sequence or of a state, changed sequences are saved
+        self.usage_index = None # UsageIndex kept up to date by the sequence
+        self.__aggregates = None
+        self.__aggregates_version = -1
+        self.__profile = None
+        self.__dirty_states = set() # States changed since the profile was compiled
+        self.__membership = None # MembershipMatrix, built again when states or their elements change
+        for state in self.states:
+            state.add_dependent(self)
         logger.debug(f"Sequence {self.name} created")
 
     # Getters
@@ -29,24 +41,69 @@ class Sequence:
         """
         Returns the energy consumption of the sequence
         """
-        energy = 0
-        for state in self.states:
-            energy += state.get_energy()
-        return energy
+        return self.__get_aggregates()[2]
     
     def get_max_power(self):
         """
         Returns the maximum power consumption of the sequence
         """
-        powers = [state.get_max_power() for state in self.states]
-        return max(powers)
+        return self.__get_aggregates()[0]
     
     def get_max_time(self):
         """
         Returns the maximum time of the sequence
         """
-        return sum([state.get_max_time() for state in self.states])
+        return self.__get_aggregates()[1]
+
+    def __get_aggregates(self):
+        """
+        Returns (max power, total time, energy) of the sequence from the membership matrix
+        Values are computed again only when the version of the sequence changed
+        """
+        if self.__aggregates_version != self.version:
+            powers, energies, durations = self.get_membership().evaluate()
+            self.__aggregates = (
+                float(powers.max()) if powers.size > 0 else 0,
+                float(durations.sum()),
+                float(energies.sum())
+            )
+            self.__aggregates_version = self.version
+        return self.__aggregates
+
+    def get_membership(self) -> MembershipMatrix:
+        """
+        Returns the state membership matrix of the sequence
+        """
+        if self.__membership is None:
+            self.__membership = build_membership(self.states)
+        return self.__membership
+
+    def get_profile(self) -> PowerProfile:
+        """
+        Returns the compiled power profile of the sequence
+        The profile is compiled on first call, then only the segments
+        of the states changed since are compiled again and patched in place
+        """
+        if self.__profile is None:
+            self.__profile = self.get_membership().compile()
+            self.__dirty_states.clear()
+            logger.debug(f"Profile of sequence {self.name} compiled")
+        elif self.__dirty_states:
+            updates = {}
+            for index, state in enumerate(self.states):
+                if state in self.__dirty_states:
+                    updates[index] = state.compile()
+            self.__profile.update_states(updates)
+            self.__dirty_states.clear()
+            logger.debug(f"Profile of sequence {self.name} patched for {len(updates)} states")
+        return self.__profile
     
+    def has_profile(self):
+        """
+        True if the profile was compiled, get_profile then only patches the states changed since
+        """
+        return self.__profile is not None
+
     def get_name(self):
         return self.name
     
@@ -55,45 +112,97 @@ class Sequence:
 
     # Setters
     #===========================================================================
+    def set_profile(self, profile: PowerProfile):
+        """
+        Use a profile compiled earlier, for example loaded from a ResultCache
+        It must be the profile of the current states
+        """
+        self.__profile = profile
+        self.__dirty_states.clear()
+
+    def set_from_dict(self, dict_sequence: dict):
+        """
+        Replace the content of the sequence in place, from a dict of to_dict
+        """
+        for state in self.states:
+            state.remove_dependent(self)
+        self.__from_dict(dict_sequence)
+
     def set_name(self, name: str):
         self.name = name
+        self.version += 1
         logger.info(f"Sequence name set to {name}")
         
     def set_description(self, description: str):
         self.description = description
+        self.version += 1
         logger.info(f"{self.name}'s description is: {description}")
     
     def add_state(self, state: State):
         self.states.append(state)
+        state.add_dependent(self)
+        self.invalidate_profile()
         logger.info(f"State {state.name} added to sequence {self.name}")
     
     def remove_state(self, state: State):
         self.states.remove(state)
+        if state not in self.states:
+            state.remove_dependent(self)
+        self.invalidate_profile()
         logger.info(f"State {state.name} removed from sequence {self.name}")
     
+    def set_usage_index(self, usage_index=None):
+        self.usage_index = usage_index
+
     def set_dict_elts(self, dict_elts: dict):
         self.dict_elts = dict_elts
         logger.debug(f"Dictionary of elements set for sequence {self.name}")
 
     # Methods
     #===========================================================================
+    def invalidate_profile(self):
+        """
+        Drop the compiled profile, it will be compiled again on next use
+        Called when states are added, removed or moved
+        """
+        self.version += 1
+        self.__profile = None
+        self.__membership = None
+        if self.usage_index is not None:
+            self.usage_index.index_sequence(self)
+
+    def state_changed(self, state: State, membership: bool=False):
+        """
+        Called by a state when its elements or their power states change
+        """
+        self.version += 1
+        if self.__profile is not None:
+            self.__dirty_states.add(state)
+        if membership:
+            self.__membership = None
+        if membership and self.usage_index is not None:
+            self.usage_index.index_state(self, state)
+
+    def content_changed(self):
+        """
+        Called by a state when its name, its description or the name of one of its elements changes
+        The profile is unchanged, the sequence must be saved again
+        """
+        self.version += 1
+
     def generate_power_data(self):
         """
-        Returns the power consumption of the sequence
+        Returns the power of each segment of the sequence and the time at which it ends
         """
-        X = []
-        T = []
-        for state in self.states:
-            Xstate, Tstate = state.generate_power_data()
-            X += Xstate # Concatenate power lists
-            T += Tstate # Concatenate time lists
-        return X, T
+        return self.get_profile().to_power_data()
     
     def shift_states(self, initial: int=0, state: State=None):
         """
         Shift all states in a sequence after initial
         """
         self.states.insert(initial, state)
+        state.add_dependent(self)
+        self.invalidate_profile()
 
     # Save and load
     #===========================================================================
@@ -108,12 +217,27 @@ class Sequence:
         self.name = dict_sequence["name"]
         self.description = dict_sequence["description"]
         self.states = [State.from_dict(dict_state, self.dict_elts) for dict_state in dict_sequence["states"]]
+        for state in self.states:
+            state.add_dependent(self)
+        self.invalidate_profile()
 
-    def from_dict(self, dict_sequence: dict):
-        sequence = Sequence()
+    def from_dict(self, dict_sequence: dict, dict_elts: dict=None):
+        sequence = Sequence(dict_elts=dict_elts)
         sequence.__from_dict(dict_sequence)
         return sequence
     
-    def to_json(self, file_path: str):
-        with open(file_path, "w") as file:
-            json.dump(self.to_dict(), file, indent=4)
\ No newline at end of file
+    def get_file_name(self):
+        return f"{self.name}.json"
+
+    def to_json(self, path: str, writer: BatchWriter = None, file_name: str = None):
+        """
+        Write the sequence to path/file_name, atomically, by default file_name is name.json
+        With a writer, the file is written when the writer commits
+        """
+        file_path = f"{path}/{file_name if file_name is not None else self.get_file_name()}"
+        content = json.dumps(self.to_dict(), indent=4)
+        if writer is None:
+            write_atomic(file_path, content)
+        else:
+            writer.write(file_path, content)
+        return file_path
\ No newline at end of file
@@ -0,0 +1,208 @@
+# File: sequence_index.py
+"""
+This file contains the summary index of the sequence files
+
+The index is a json file written next to the sequence files. For each sequence it keeps
+its file, the size and modification time of the file, the content hash of each element it uses
+and a summary: name, description, state count, energy, peak power, duration and content hash.
+Listing and sorting sequences only reads the index, a Sequence is built
+when it is selected or simulated.
+
+An entry is stale when its file changed on disk or when one of its elements changed,
+the file is then loaded again and its summary computed with the current elements.
+
+"""
+
+from src.logger import logger
+from src.loader import scan_json
+from src.elements import DummyElement
+import hashlib
+import json
+import os
+
+SEQUENCE_INDEX_FILE = "_index.json"
+SUMMARY_FIELDS = ("name", "description", "state_count", "energy", "max_power", "duration", "hash")
+
+class SequenceIndex:
+    def __init__(self, path: str):
+        self.path = path # Directory of the sequence files
+        self.file_path = os.path.join(path, SEQUENCE_INDEX_FILE)
+        self.entries = {} # {name: entry}
+        self.names_by_file = {} # {file: name}
+        self.modified = False
+
+    # Getters
+    #===========================================================================
+    def get_sequence_names(self):
+        return list(self.entries.keys())
+
+    def get_entry(self, name: str):
+        return self.entries[name]
+
+    def get_element_names(self, name: str):
+        """
+        Returns the names of the elements used by a sequence, without reading its file
+        """
+        return list(self.entries[name]["elements"])
+
+    def is_current(self, name: str, element_hashes: dict):
+        """
+        Returns True if the summary of a sequence was computed with the current elements
+        element_hashes is {element name: content hash} of the elements of the project
+        """
+        indexed_hashes = self.entries[name].get("elements")
+        if not isinstance(indexed_hashes, dict):
+            return False
+        return all(element_hashes.get(element_name) == element_hash for element_name, element_hash in indexed_hashes.items())
+
+    def get_summaries(self, sort_key: str=None, reverse: bool=False):
+        """
+        Returns the summaries of the sequences, sorted by sort_key (a field of SUMMARY_FIELDS)
+        """
+        summaries = [{field: entry[field] for field in SUMMARY_FIELDS} for entry in self.entries.values()]
+        if sort_key is not None:
+            if sort_key not in SUMMARY_FIELDS:
+                raise ValueError(f"Invalid sort key: {sort_key}")
+            summaries.sort(key=lambda summary: summary[sort_key], reverse=reverse)
+        return summaries
+
+    def read_sequence_raw(self, name: str):
+        with open(os.path.join(self.path, self.entries[name]["file"]), "rb") as file:
+            return file.read()
+
+    def read_sequence(self, name: str):
+        return json.loads(self.read_sequence_raw(name))
+
+    # Methods
+    #===========================================================================
+    def load(self):
+        """
+        Read the index file, a missing or unreadable index is empty
+        """
+        try:
+            with open(self.file_path, "r") as file:
+                self.entries = {entry["name"]: entry for entry in json.load(file)}
+        except FileNotFoundError:
+            self.entries = {}
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            logger.error(f"Can not read {self.file_path}, the index is built again: {error}")
+            self.entries = {}
+        self.names_by_file = {entry["file"]: name for name, entry in self.entries.items()}
+        return self
+
+    def save(self):
+        """
+        Write the index file if it was modified
+        """
+        if not self.modified:
+            return
+        temporary_path = self.file_path + ".tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(list(self.entries.values()), file, indent=4)
+        os.replace(temporary_path, self.file_path)
+        self.modified = False
+        logger.debug(f"Sequence index saved with {len(self.entries)} entries")
+
+    def refresh(self, element_hashes: dict):
+        """
+        Drop the entries of removed files and of sequences whose elements changed,
+        returns the paths of the files to load again
+        element_hashes is {element name: content hash} of the elements of the project
+        """
+        stats = {}
+        for file_path in scan_json(self.path, exclude=(SEQUENCE_INDEX_FILE,)):
+            stat = os.stat(file_path)
+            stats[os.path.basename(file_path)] = (stat.st_mtime_ns, stat.st_size)
+        stale = set(stats)
+        for name, entry in list(self.entries.items()):
+            if entry["file"] in stale and stats[entry["file"]] == (entry["mtime_ns"], entry["size"]) and self.is_current(name, element_hashes):
+                stale.discard(entry["file"])
+            else:
+                self.remove(name)
+        return [os.path.join(self.path, filename) for filename in sorted(stale)]
+
+    def update(self, sequence, file_path: str, known_hashes: dict=None, content_hash: str=None):
+        """
+        Write the summary of a sequence saved to file_path
+        known_hashes is {element: content hash} of the elements already hashed,
+        content_hash is the hash of the saved sequence when it is known
+        """
+        stat = os.stat(file_path)
+        file_name = os.path.basename(file_path)
+        previous_name = self.names_by_file.get(file_name)
+        if previous_name is not None and previous_name != sequence.name:
+            self.remove(previous_name)
+        entry = summarize(sequence, content_hash)
+        entry["elements"] = get_element_hashes(sequence, known_hashes)
+        entry["file"] = file_name
+        entry["mtime_ns"] = stat.st_mtime_ns
+        entry["size"] = stat.st_size
+        if self.entries.get(sequence.name) != entry:
+            self.remove(sequence.name)
+            self.entries[sequence.name] = entry
+            self.names_by_file[file_name] = sequence.name
+            self.modified = True
+
+    def remove(self, name: str):
+        entry = self.entries.pop(name, None)
+        if entry is not None:
+            if self.names_by_file.get(entry["file"]) == name:
+                del self.names_by_file[entry["file"]]
+            self.modified = True
+
+# Function
+#===========================================================================
+def summarize(sequence, content_hash: str=None):
+    """
+    Returns the summary of a sequence, a dict of SUMMARY_FIELDS
+    content_hash is the hash of sequence.to_dict() when it is known
+    """
+    profile = sequence.get_profile()
+    return {
+        "name": sequence.name,
+        "description": sequence.description,
+        "state_count": len(sequence.states),
+        "energy": float(profile.get_energy()),
+        "max_power": float(profile.get_max_power()),
+        "duration": float(profile.get_total_time()),
+        "hash": content_hash if content_hash is not None else get_content_hash(sequence.to_dict())
+    }
+
+def get_element_names(dict_sequence: dict):
+    """
+    Returns the sorted names of the elements used by a saved sequence
+    """
+    return sorted({dict_elt["element"] for dict_state in dict_sequence["states"] for dict_elt in dict_state["list_elements"]})
+
+def get_element_hashes(sequence, known_hashes: dict=None):
+    """
+    Returns {element name: content hash} of the elements used by a sequence, None for missing elements
+    known_hashes is {element: content hash}, the other elements are hashed
+    """
+    known_hashes = known_hashes if known_hashes is not None else {}
+    element_hashes = {}
+    for element in dict.fromkeys(elt["element"] for state in sequence.states for elt in state.elements):
+        if isinstance(element, DummyElement):
+            element_hashes[element.get_saved_name()] = None
+        elif element in known_hashes:
+            element_hashes[element.get_name()] = known_hashes[element]
+        else:
+            element_hashes[element.get_name()] = get_content_hash(element.to_dict())
+    return element_hashes
+
+def get_element_hash(element, hash_cache: dict):
+    """
+    Returns the content hash of an element
+    hash_cache is {element: (version, content hash)}, an element is hashed again only when it changed
+    """
+    version, content_hash = hash_cache.get(element, (None, None))
+    if version != element.version:
+        content_hash = get_content_hash(element.to_dict())
+        hash_cache[element] = (element.version, content_hash)
+    return content_hash
+
+def get_content_hash(dict_sequence: dict):
+    """
+    Returns the sha256 of a saved sequence or element, independent of the json formatting
+    """
+    return hashlib.sha256(json.dumps(dict_sequence, sort_keys=True).encode()).hexdigest()
@@ -0,0 +1,117 @@
+# File: startup_trace.py
+"""
+This file contains the startup time report (--startup-trace)
+
+While started, every module imported from source or from an extension is timed:
+    cumulative  time to execute the module, including the modules it imports
+    self        cumulative time minus the time of the modules it imports
+Phases (importing the GUI, loading the project, ...) are timed by main.py with phase().
+The report is written to stderr, so the output of the command line is unchanged.
+
+A disabled StartupTrace does nothing, main.py uses it the same way in both cases.
+
+"""
+
+from contextlib import contextmanager
+import sys
+import time
+
+class StartupTrace:
+    def __init__(self, enabled: bool=True):
+        self.enabled = enabled
+        self.modules = {} # {module name: (cumulative time, self time)}
+        self.phases = [] # [(phase name, time)]
+        self.stack = [] # Time of the imports nested in the modules being executed
+        self.finder = _TimingFinder(self)
+        self.start_time = time.perf_counter()
+
+    # Methods
+    #===========================================================================
+    def start(self):
+        if self.enabled and self.finder not in sys.meta_path:
+            sys.meta_path.insert(0, self.finder)
+        self.start_time = time.perf_counter()
+        return self
+
+    def stop(self):
+        if self.finder in sys.meta_path:
+            sys.meta_path.remove(self.finder)
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Time the block of a with statement
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.enabled:
+                self.phases.append((name, time.perf_counter() - start))
+
+    def module_executed(self, name: str, cumulative: float, children: float):
+        self.modules[name] = (cumulative, cumulative - children)
+
+    def report(self, output=None, limit: int=25):
+        """
+        Write the phases and the slowest imports, then stop timing imports
+        """
+        self.stop()
+        if not self.enabled:
+            return
+        output = output if output is not None else sys.stderr
+        total = time.perf_counter() - self.start_time
+        output.write("Startup trace (seconds)\n")
+        for name, elapsed in self.phases:
+            output.write(f"  {elapsed:8.3f}  {name}\n")
+        output.write(f"  {total:8.3f}  total\n")
+        output.write(f"Slowest of {len(self.modules)} imported modules (self, cumulative)\n")
+        slowest = sorted(self.modules.items(), key=lambda item: item[1][1], reverse=True)[:limit]
+        for name, (cumulative, self_time) in slowest:
+            output.write(f"  {self_time:8.3f}  {cumulative:8.3f}  {name}\n")
+        output.flush()
+
+class _TimingFinder:
+    """
+    Meta path finder timing the execution of the modules found by the other finders
+    """
+    def __init__(self, trace: StartupTrace):
+        self.trace = trace
+
+    def find_spec(self, fullname: str, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        loader = spec.loader
+        # Built-in and frozen importers are classes shared by every module, they are not timed
+        if loader is None or isinstance(loader, type) or not hasattr(type(loader), "exec_module"):
+            return spec
+        exec_module = type(loader).exec_module # Not a wrapper set by a pending import of the same loader
+        trace = self.trace
+
+        def timed_exec_module(module):
+            start = time.perf_counter()
+            trace.stack.append(0.0)
+            try:
+                exec_module(loader, module)
+            finally:
+                elapsed = time.perf_counter() - start
+                children = trace.stack.pop()
+                if trace.stack:
+                    trace.stack[-1] += elapsed
+                trace.module_executed(fullname, elapsed, children)
+                try:
+                    del loader.exec_module
+                except AttributeError:
+                    pass
+
+        try:
+            loader.exec_module = timed_exec_module
+        except AttributeError:
+            pass # Loader without instance attributes, not timed
+        return spec
@@ -1,5 +1,7 @@
 from src.elements import Element, DummyElement
 import json
+import weakref
+import numpy as np
 from src.logger import logger
 
 """
@@ -13,12 +15,17 @@ class State:
     def __init__(self,
                 name=None,
                 description: str = "",
-                elements=[] #[{"element": None, "power_state": None}]
+                elements=None #[{"element": None, "power_state": None}]
                 ):
         
-        self.elements = elements
+        self.elements = []
         self.name = str(name)
         self.description = str(description)
+        self.version = 0 # Incremented on each change of membership or of a used power state
+        self.dependents = weakref.WeakSet() # Sequences using this state
+        self.__aggregates = None
+        self.__aggregates_version = -1
+        self.set_elements(elements if elements is not None else [])
     
     def __str__(self):
         string = (
@@ -41,20 +48,14 @@ class State:
         """
         Returns the energy consumption of the state
         """
-        for elt in self.elements:
-            energy = 0
-            energy += elt["element"].get_power(elt["power_state"]) * elt["element"].get_time(elt["power_state"])
-        return energy
+        return self.__get_aggregates()[2]
     
     def get_max_power(self):
         """
         Returns the maximum power consumption of the state
         Max power is at the beginning of the state
         """
-        max_power = 0
-        for elt in self.elements:
-            max_power += elt["element"].get_power(elt["power_state"])
-        return max_power
+        return self.__get_aggregates()[0]
     
     def get_name(self):
         return self.name
@@ -66,26 +67,99 @@ class State:
         """
         Returns the maximum time of the state
         """
-        return max([elt["element"].get_time(elt["power_state"]) for elt in self.elements])
+        return self.__get_aggregates()[1]
+
+    def __get_aggregates(self):
+        """
+        Returns (max power, max time, energy) of the state
+        Values are computed again only when the version of the state changed
+        """
+        if self.__aggregates_version != self.version:
+            max_power = 0
+            max_time = 0
+            energy = 0
+            for elt in self.elements:
+                power_state = elt["element"].get_power_state(elt["power_state"])
+                max_power += power_state.get_power()
+                max_time = max(max_time, power_state.get_time())
+                energy += power_state.get_energy()
+            self.__aggregates = (max_power, max_time, energy)
+            self.__aggregates_version = self.version
+        return self.__aggregates
 
     # Setters
     #===========================================================================
     def set_description(self, description: str = ""):
         self.description = str(description)
+        self.content_changed()
         logger.info(f"{self.name}'s description is: {description}")
     
     def set_name(self, name: str):
         self.name = name
+        self.content_changed()
         logger.info(f"State name set to {name}")
 
     # Methods
     #===========================================================================
     def add_element(self, element=[{"element": None, "power_state": None}]):
         self.elements.append(element)
+        element["element"].add_dependent(self)
+        self.changed(membership=True)
 
-    def generate_power_data(self):
+    def remove_element(self, element: Element):
+        """
+        Remove all the usages of element from the state
         """
-        Returns the power consumption of the state
+        self.set_elements([elt for elt in self.elements if elt["element"] is not element])
+
+    def set_elements(self, elements: list):
+        """
+        Replace all the elements of the state
+        """
+        for elt in self.elements:
+            elt["element"].remove_dependent(self)
+        self.elements = list(elements)
+        for elt in self.elements:
+            elt["element"].add_dependent(self)
+        self.changed(membership=True)
+
+    # Dependencies
+    #===========================================================================
+    def add_dependent(self, sequence):
+        self.dependents.add(sequence)
+
+    def remove_dependent(self, sequence):
+        self.dependents.discard(sequence)
+
+    def changed(self, membership: bool=False):
+        """
+        Increment the version and notify the sequences using this state
+        membership is True when elements were added or removed
+        """
+        self.version += 1
+        for sequence in list(self.dependents):
+            sequence.state_changed(self, membership)
+
+    def content_changed(self):
+        """
+        Notify the sequences using this state that their saved content changed
+        Called for names and descriptions, which do not change the profile
+        """
+        for sequence in list(self.dependents):
+            sequence.content_changed()
+
+    def element_changed(self, element: Element, power_state: str):
+        """
+        Called by an element when one of its power states changes
+        """
+        for elt in self.elements:
+            if elt["element"] is element and elt["power_state"] == power_state:
+                self.changed()
+                return
+
+    def compile(self):
+        """
+        Returns the durations and powers of the segments of the state
         All device boot at the same time, and state end when the last device change state
         
         Example: with 3 devices A, B and C
@@ -96,20 +170,23 @@ class State:
         |A|
         |  B   |
         |      C     |	
+
+        There is one segment per element, sorted by end time,
+        the power of a segment is the sum of the elements still running
         """
-        X = []
-        T = []
-        list_elements = [elt["element"] for elt in self.elements]
-        list_power_states = [elt["power_state"] for elt in self.elements]
+        powers = np.array([elt["element"].get_power(elt["power_state"]) for elt in self.elements], dtype=float)
+        times = np.array([elt["element"].get_time(elt["power_state"]) for elt in self.elements], dtype=float)
+        order = np.argsort(times, kind="stable")
+        durations = np.diff(times[order], prepend=0.0)
+        segment_powers = np.cumsum(powers[order][::-1])[::-1]
+        return durations, segment_powers
 
-        powers_times = [(elt.get_power(power_state), elt.get_time(power_state)) for elt, power_state in zip(list_elements, list_power_states)]
-        sorted_powers_times = sorted(powers_times, key=lambda x: x[1])
-        logger.debug(f"Power and times: {powers_times}")
-        logger.debug(f"Sorted power and times: {sorted_powers_times}")
-        for i in range(len(sorted_powers_times)):
-            X.append(sorted_powers_times[i][0])
-            T.append(sorted_powers_times[i][1])
-        return X, T
+    def generate_power_data(self):
+        """
+        Returns the power of each segment of the state and the time at which it ends
+        """
+        durations, powers = self.compile()
+        return powers, np.cumsum(durations)
 
     # Save and load
     #===========================================================================
@@ -117,20 +194,22 @@ class State:
         return {
             "name": self.name,
             "description": self.description,
-            "list_elements": [{"element": elt["element"].get_name(), "power_state": elt["power_state"]} for elt in self.elements]
+            "list_elements": [{"element": elt["element"].get_saved_name(), "power_state": elt["power_state"]} for elt in self.elements]
         }
-    def from_dict(dict_state, dict_elements: dict, dict_available_elts: dict):
-        state = State()
-        state.name = dict_state["name"]
-        state.description = dict_state["description"]
-        list_elements = dict_state["list_elements"]
-        for elt_name in list_elements:
+    def from_dict(dict_state, dict_available_elts: dict=None):
+        if dict_available_elts is None:
+            dict_available_elts = {}
+        elements = []
+        for dict_elt in dict_state["list_elements"]:
+            elt_name = dict_elt["element"]
             try:
                 new_element = dict_available_elts[elt_name]
             except KeyError:
                 new_element = DummyElement(elt_name)
                 logger.error(f"Element {elt_name} not found, replaced by a dummy element")
-            state.elements.append({"element": new_element, "power_state": elt_name["power_state"]})
+            elements.append({"element": new_element, "power_state": dict_elt["power_state"]})
+        # Set at once, one change instead of one per element
+        return State(dict_state["name"], dict_state["description"], elements)
     
     def to_json(self, file_path: str):
         with open(file_path, "w") as file:
@@ -0,0 +1,164 @@
+# File: sweep.py
+"""
+This file contains the parameter sweep engine
+
+A sweep evaluates a sequence over the cartesian product of battery parameters
+(capacity, efficiency, input power) and element power state overrides.
+Each combination of element overrides is one task for the process pool,
+its profile is compiled once and shared by every battery combination.
+
+"""
+
+from src.logger import logger
+from src.sequence import Sequence
+from src.elements import Element
+from src.battery import Battery
+from src.element_library import POWER_STATES
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import json
+import numpy as np
+
+# Profiles compiled by the current process, keyed by sequence content and element overrides
+_profile_cache = {}
+PROFILE_CACHE_SIZE = 256
+
+class Sweep:
+    def __init__(self,
+        sequence: Sequence=None,
+        battery: Battery=None,
+        capacities: list=None,
+        efficiencies: list=None,
+        input_powers: list=None,
+        overrides: dict=None # {(element name, power state, "power" or "time"): [values]}
+        ):
+
+        if sequence is None:
+            raise ValueError("Sequence must be provided")
+        if battery is None:
+            raise ValueError("Battery must be provided")
+        self.sequence = sequence
+        self.battery = battery
+        self.capacities = capacities if capacities is not None else [battery.get_capacity()]
+        self.efficiencies = efficiencies if efficiencies is not None else [battery.get_efficiency()]
+        self.input_powers = input_powers if input_powers is not None else [battery.get_input_power()]
+        self.overrides = overrides if overrides is not None else {}
+        for name, values in (("capacities", self.capacities), ("efficiencies", self.efficiencies), ("input_powers", self.input_powers)):
+            if len(values) == 0:
+                raise ValueError(f"No value to sweep in {name}")
+        referenced_elements = self.get_referenced_elements()
+        for (element_name, power_state, field), values in self.overrides.items():
+            if element_name not in referenced_elements:
+                raise ValueError(f"Element {element_name} is not used by sequence {sequence.get_name()}")
+            if power_state not in POWER_STATES:
+                raise ValueError(f"Invalid power state: {power_state}")
+            if field not in ("power", "time"):
+                raise ValueError("Invalid override field")
+            if len(values) == 0:
+                raise ValueError(f"No value to sweep in {element_name}.{power_state}.{field}")
+
+    def get_size(self):
+        """
+        Returns the number of evaluations of the sweep
+        """
+        size = len(self.capacities)*len(self.efficiencies)*len(self.input_powers)
+        for values in self.overrides.values():
+            size *= len(values)
+        return size
+
+    def get_referenced_elements(self):
+        """
+        Returns the dict of elements used by the sequence
+        """
+        elements = {}
+        for state in self.sequence.states:
+            for elt in state.elements:
+                elements[elt["element"].get_name()] = elt["element"]
+        return elements
+
+    # Methods
+    #===========================================================================
+    def run(self, max_workers: int=None):
+        """
+        Evaluate every combination, returns a dict of columns (numpy arrays)
+        max_workers=1 runs in the current process
+        """
+        override_keys = list(self.overrides.keys())
+        combinations = list(itertools.product(*[self.overrides[key] for key in override_keys]))
+        sequence_dict = self.sequence.to_dict()
+        element_dicts = [element.to_dict() for element in self.get_referenced_elements().values()]
+        battery_grid = (self.capacities, self.efficiencies, self.input_powers)
+        tasks = [(sequence_dict, element_dicts, override_keys, combination, battery_grid) for combination in combinations]
+        logger.info(f"Sweep of {self.get_size()} evaluations in {len(tasks)} tasks")
+
+        if max_workers == 1:
+            results = [_evaluate(*task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(_evaluate, *zip(*tasks)))
+
+        columns = {name: np.concatenate([result[name] for result in results]) for name in results[0]}
+        n_battery = len(self.capacities)*len(self.efficiencies)*len(self.input_powers)
+        for i, key in enumerate(override_keys):
+            values = np.array([combination[i] for combination in combinations], dtype=float)
+            columns[".".join(key)] = np.repeat(values, n_battery)
+        return columns
+
+# Function
+#===========================================================================
+def save_sweep(columns: dict, file_path: str):
+    """
+    Save sweep results to a compressed columnar file (numpy .npz)
+    """
+    np.savez_compressed(file_path, **columns)
+
+def load_sweep(file_path: str):
+    """
+    Load sweep results saved by save_sweep
+    """
+    with np.load(file_path) as data:
+        return {name: data[name] for name in data.files}
+
+def _compile_profile(sequence_dict: dict, element_dicts: list, override_keys: list, combination: tuple):
+    """
+    Returns the profile of the sequence with the overrides applied
+    Profiles are cached for the lifetime of the worker process
+    """
+    key = (json.dumps([sequence_dict, element_dicts], sort_keys=True), tuple(override_keys), combination)
+    if key not in _profile_cache:
+        if len(_profile_cache) >= PROFILE_CACHE_SIZE:
+            _profile_cache.clear()
+        dict_elts = {}
+        for element_dict in element_dicts:
+            element = Element.from_dict(None, element_dict)
+            dict_elts[element.get_name()] = element
+        for (element_name, power_state, field), value in zip(override_keys, combination):
+            if field == "power":
+                dict_elts[element_name].get_power_state(power_state).set_power(value)
+            else:
+                dict_elts[element_name].get_power_state(power_state).set_time(value)
+        sequence = Sequence.from_dict(None, sequence_dict, dict_elts)
+        _profile_cache[key] = sequence.get_profile()
+    return _profile_cache[key]
+
+def _evaluate(sequence_dict: dict, element_dicts: list, override_keys: list, combination: tuple, battery_grid: tuple):
+    """
+    Evaluate every battery combination for one combination of element overrides
+    """
+    profile = _compile_profile(sequence_dict, element_dicts, override_keys, combination)
+    capacities, efficiencies, input_powers = battery_grid
+    rows = []
+    for capacity, efficiency, input_power in itertools.product(capacities, efficiencies, input_powers):
+        battery = Battery(capacity=capacity, efficiency=efficiency, input_power=input_power)
+        rows.append((capacity, efficiency, input_power, battery.lifetime(profile, capacity)))
+    rows = np.array(rows, dtype=float).reshape(-1, 4)
+    n_rows = rows.shape[0]
+    return {
+        "capacity": rows[:, 0],
+        "efficiency": rows[:, 1],
+        "input_power": rows[:, 2],
+        "lifetime": rows[:, 3],
+        "energy": np.full(n_rows, profile.get_energy()),
+        "max_power": np.full(n_rows, profile.get_max_power()),
+        "time": np.full(n_rows, profile.get_total_time())
+    }
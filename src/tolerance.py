@@ -0,0 +1,237 @@
+# File: tolerance.py
+"""
+This file contains the Monte Carlo tolerance analysis
+
+Power and time of a PowerState are typical values, a tolerance describes
+how they are spread in production parts:
+    {"kind": "normal", "std": 0.1e-3}           normal law centered on the typical value
+    {"kind": "uniform", "min": 1e-3, "max": 2e-3} uniform law between min and max
+    {"kind": "minmax", "min": 1e-3, "max": 2e-3}  triangular law min/typical/max
+
+Samples are evaluated as (samples x memberships) numpy arrays, in chunks
+so memory does not grow with the number of samples.
+Random streams are derived from (seed, stream) so a run can be split across
+processes and still be reproduced.
+
+"""
+
+from src.logger import logger
+from src.sequence import Sequence
+from src.battery import Battery
+import math
+import numpy as np
+
+DISTRIBUTION_KINDS = ("normal", "uniform", "minmax")
+PERCENTILES = (1, 50, 99)
+CHUNK_VALUES = 1 << 20 # Samples x memberships evaluated at once
+CHUNK_SAMPLES = 1024 # Fewest samples evaluated at once
+SORT_NETWORK_SIZE = 8 # Largest state sorted without argsort
+
+# Function
+#===========================================================================
+def check_tolerance(tolerance: dict):
+    """
+    Raise a ValueError if tolerance is not a valid distribution
+    """
+    if tolerance is None:
+        return
+    kind = tolerance.get("kind")
+    if kind not in DISTRIBUTION_KINDS:
+        raise ValueError(f"Invalid distribution kind: {kind}")
+    if kind == "normal" and "std" not in tolerance:
+        raise ValueError("Normal distribution needs std")
+    if kind in ("uniform", "minmax") and ("min" not in tolerance or "max" not in tolerance):
+        raise ValueError(f"{kind} distribution needs min and max")
+
+def sample_tolerance(tolerance: dict, typical: float, rng: np.random.Generator, n_samples: int):
+    """
+    Returns n_samples values drawn around typical, values are never negative
+    """
+    if tolerance is None:
+        return np.full(n_samples, float(typical))
+    check_tolerance(tolerance)
+    match tolerance["kind"]:
+        case "normal":
+            values = rng.normal(typical, tolerance["std"], n_samples)
+        case "uniform":
+            values = rng.uniform(tolerance["min"], tolerance["max"], n_samples)
+        case "minmax":
+            low, high = tolerance["min"], tolerance["max"]
+            mode = min(max(typical, low), high)
+            values = rng.triangular(low, mode, high, n_samples) if high > low else np.full(n_samples, float(low))
+    return np.maximum(values, 0)
+
+def get_percentiles(values: np.ndarray, percentiles: tuple=PERCENTILES):
+    """
+    Returns {"P1": ..., "P50": ..., "P99": ...} of values
+    Percentiles are picked among the samples, so infinite lifetimes are kept
+    """
+    quantiles = np.quantile(values, np.array(percentiles)/100, method="inverted_cdf")
+    return {f"P{percentile}": float(value) for percentile, value in zip(percentiles, quantiles)}
+
+def sort_memberships(times: np.ndarray, powers: np.ndarray, axis: int=-1):
+    """
+    Returns times and powers sorted by time along axis, ties keep their order
+    Small states are sorted with compare and swap passes, cheaper than argsort on a short axis
+    """
+    if times.shape[axis] > SORT_NETWORK_SIZE:
+        order = np.argsort(times, axis=axis, kind="stable")
+        return np.take_along_axis(times, order, axis=axis), np.take_along_axis(powers, order, axis=axis)
+    times = np.moveaxis(times, axis, 0)
+    powers = np.moveaxis(powers, axis, 0)
+    for last in range(times.shape[0] - 1, 0, -1):
+        for i in range(last):
+            swap = times[i] > times[i+1]
+            times[i], times[i+1] = np.where(swap, times[i+1], times[i]), np.where(swap, times[i], times[i+1])
+            powers[i], powers[i+1] = np.where(swap, powers[i+1], powers[i]), np.where(swap, powers[i], powers[i+1])
+    return np.moveaxis(times, 0, axis), np.moveaxis(powers, 0, axis)
+
+def accumulate(ufunc: np.ufunc, values: np.ndarray):
+    """
+    Returns ufunc.accumulate of values along the first axis, computed in place
+    Rows are combined one by one, numpy accumulates a leading axis value by value
+    """
+    for i in range(1, values.shape[0]):
+        ufunc(values[i-1], values[i], out=values[i])
+    return values
+
+def get_rng(seed: int=0, stream: int=0):
+    """
+    Returns the random generator of a stream, streams of a same seed are independent
+    """
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(stream,)))
+
+class ToleranceAnalysis:
+    def __init__(self, sequence: Sequence=None, battery: Battery=None):
+        if sequence is None:
+            raise ValueError("Sequence must be provided")
+        if battery is None:
+            raise ValueError("Battery must be provided")
+        self.sequence = sequence
+        self.battery = battery
+
+    # Methods
+    #===========================================================================
+    def get_memberships(self):
+        """
+        Returns the power states sampled, the column of each membership of every non empty state
+        among them, and the index of the first membership of each state
+        A power state used in several states gets the same sample in all of them
+        """
+        memberships = []
+        offsets = []
+        for state in self.sequence.states:
+            if len(state.elements) == 0:
+                continue
+            offsets.append(len(memberships))
+            memberships += [(elt["element"], elt["power_state"]) for elt in state.elements]
+
+        # Sample each power state once, in a stable order so runs can be reproduced
+        power_states = {(element.get_name(), power_state): element.get_power_state(power_state) for element, power_state in memberships}
+        keys = sorted(power_states)
+        columns = {key: i for i, key in enumerate(keys)}
+        index = np.array([columns[(element.get_name(), power_state)] for element, power_state in memberships], dtype=np.int64)
+        return [power_states[key] for key in keys], index, np.array(offsets, dtype=np.int64)
+
+    def sample(self, n_samples: int, rng: np.random.Generator, memberships: tuple=None):
+        """
+        Returns the sampled power and time of every membership of every non empty state,
+        as (samples x memberships) arrays, and the index of the first membership of each state
+        memberships is the result of get_memberships, None computes it
+        """
+        memberships = memberships if memberships is not None else self.get_memberships()
+        powers, times = self.__sample_rows(n_samples, rng, memberships)
+        return powers.T, times.T, memberships[2]
+
+    def __sample_rows(self, n_samples: int, rng: np.random.Generator, memberships: tuple):
+        """
+        Returns the sampled power and time as (memberships x samples) arrays
+        """
+        power_states, index, _ = memberships
+        powers = np.empty((len(power_states), n_samples))
+        times = np.empty((len(power_states), n_samples))
+        for i, power_state in enumerate(power_states):
+            powers[i] = sample_tolerance(power_state.get_power_tolerance(), power_state.get_power(), rng, n_samples)
+            times[i] = sample_tolerance(power_state.get_time_tolerance(), power_state.get_time(), rng, n_samples)
+        return powers[index], times[index]
+
+    def run(self, n_samples: int=100000, seed: int=0, stream: int=0):
+        """
+        Returns a dict of arrays with one value per sample:
+        energy and duration of a cycle, peak power and battery lifetime (in seconds),
+        and "percentiles": {name: get_percentiles of the array}
+
+        Each state is split into segments as State.compile does, the lifetime is solved
+        per segment like Battery.lifetime, so a discharge peak inside a state is found
+        Samples are drawn and evaluated in chunks of about CHUNK_VALUES memberships,
+        percentiles are taken over all samples
+        """
+        rng = get_rng(seed, stream)
+        memberships = self.get_memberships()
+        _, index, offsets = memberships
+        results = {name: np.empty(n_samples) for name in ("energy", "time", "max_power", "lifetime")}
+        if offsets.size == 0:
+            results = {"energy": np.zeros(n_samples), "time": np.zeros(n_samples), "max_power": np.zeros(n_samples), "lifetime": np.full(n_samples, math.inf)}
+        else:
+            # States grouped by number of memberships, sorted together
+            counts = np.diff(np.append(offsets, index.size))
+            groups = [offsets[counts == count][:, None] + np.arange(count) for count in np.unique(counts) if count > 1]
+            chunk = max(CHUNK_SAMPLES, CHUNK_VALUES//index.size)
+            for first in range(0, n_samples, chunk):
+                last = min(first + chunk, n_samples)
+                powers, times = self.__sample_rows(last - first, rng, memberships)
+                for name, values in self.__evaluate(powers, times, offsets, groups).items():
+                    results[name][first:last] = values
+
+        logger.info(f"Tolerance analysis of {self.sequence.get_name()} on {n_samples} samples")
+        results["percentiles"] = {name: get_percentiles(values) for name, values in results.items()}
+        return results
+
+    def __evaluate(self, powers: np.ndarray, times: np.ndarray, offsets: np.ndarray, groups: list):
+        """
+        Returns the energy, duration, peak power and lifetime of a chunk of (memberships x samples)
+        groups holds the (states x memberships) rows of the states with more than one membership
+        """
+        n_samples = powers.shape[1]
+        # Segments of each state, sorted by end time, power of the elements still running
+        segment_durations = times
+        segment_powers = powers
+        for rows in groups:
+            sorted_times, sorted_powers = sort_memberships(times[rows], powers[rows], axis=1)
+            segment_durations[rows] = np.diff(sorted_times, axis=1, prepend=0.0)
+            segment_powers[rows] = np.moveaxis(accumulate(np.add, np.moveaxis(sorted_powers, 1, 0)[::-1])[::-1], 0, 1)
+
+        cum_time = accumulate(np.add, segment_durations.copy())
+        cum_net = accumulate(np.add, segment_powers*segment_durations)
+        energy = cum_net[-1].copy()
+        cum_net = self.battery.net_energy(cum_net, cum_time)
+        net_peak = accumulate(np.maximum, cum_net.copy())
+        cycle_time = cum_time[-1]
+        cycle_net = cum_net[-1]
+        cycle_peak = net_peak[-1]
+
+        initial = self.battery.get_current_capacity()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # Whole cycles before the battery can be emptied inside a cycle
+            depleted = cycle_peak >= initial
+            immortal = ~depleted & (cycle_net <= 0)
+            n_cycles = np.where(depleted | immortal, 0, np.ceil((initial - cycle_peak)/cycle_net))
+            remaining = initial - n_cycles*cycle_net
+
+            # First segment of the last cycle at which the battery is empty, net energy is linear over a segment
+            crossed = net_peak >= remaining
+            last = np.argmax(crossed, axis=0)
+            columns = np.arange(n_samples)
+            previous_net = np.where(last > 0, cum_net[last-1, columns], 0)
+            previous_time = np.where(last > 0, cum_time[last-1, columns], 0)
+            rate = segment_powers[last, columns]*(100/self.battery.get_efficiency()) - self.battery.get_input_power()
+            partial = np.where(crossed[-1], previous_time + (remaining - previous_net)/rate, cycle_time)
+            lifetime = np.where(immortal, math.inf, n_cycles*cycle_time + partial)
+        if initial <= 0:
+            lifetime = np.zeros(n_samples)
+        return {
+            "energy": energy,
+            "time": cycle_time,
+            "max_power": segment_powers[offsets].max(axis=0),
+            "lifetime": lifetime
+        }
@@ -0,0 +1,172 @@
+# File: trace.py
+"""
+This file contains the binary trace format of simulation output
+
+A trace file is a small header followed by fixed size records:
+    header      magic, format version, data offset, record count (struct TRACE_HEADER)
+    metadata    json, padded so records start on a DATA_ALIGNMENT boundary
+    records     TRACE_DTYPE: start time, duration, power and battery level at the end of the segment
+
+Records are appended in chunks by TraceWriter, so a trace never has to fit in memory.
+Trace opens a file with numpy.memmap: slicing a column reads only the pages it touches.
+
+"""
+
+from src.logger import logger
+import json
+import numpy as np
+import os
+import struct
+
+TRACE_MAGIC = b"PWRTRACE"
+TRACE_VERSION = 1
+TRACE_HEADER = struct.Struct("<8sIIQ") # magic, version, data offset, record count
+TRACE_DTYPE = np.dtype([("start", "<f8"), ("duration", "<f8"), ("power", "<f8"), ("battery", "<f8")])
+DATA_ALIGNMENT = 64
+CHUNK_RECORDS = 1 << 20 # Records generated at once by write_simulation
+
+class TraceWriter:
+    def __init__(self, file_path: str, metadata: dict=None):
+        self.file_path = file_path
+        self.count = 0
+        encoded_metadata = json.dumps(metadata if metadata is not None else {}).encode()
+        header_size = TRACE_HEADER.size + 4 + len(encoded_metadata)
+        self.data_offset = -(-header_size//DATA_ALIGNMENT)*DATA_ALIGNMENT
+        self.file = open(file_path, "wb")
+        self.file.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, self.data_offset, 0))
+        self.file.write(struct.pack("<I", len(encoded_metadata)))
+        self.file.write(encoded_metadata)
+        self.file.write(bytes(self.data_offset - header_size))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    # Methods
+    #===========================================================================
+    def append(self, start, duration, power, battery):
+        """
+        Append segments, arguments are arrays of the same length
+        """
+        records = np.empty(np.size(start), dtype=TRACE_DTYPE)
+        records["start"] = start
+        records["duration"] = duration
+        records["power"] = power
+        records["battery"] = battery
+        self.file.write(records.tobytes())
+        self.count += records.size
+
+    def flush(self):
+        """
+        Write the record count in the header and flush the file
+        """
+        position = self.file.tell()
+        self.file.seek(0)
+        self.file.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, self.data_offset, self.count))
+        self.file.seek(position)
+        self.file.flush()
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.flush()
+        self.file.close()
+        logger.info(f"Trace {self.file_path} written with {self.count} segments")
+
+class Trace:
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        with open(file_path, "rb") as file:
+            magic, version, self.data_offset, count = TRACE_HEADER.unpack(file.read(TRACE_HEADER.size))
+            if magic != TRACE_MAGIC:
+                raise ValueError(f"{file_path} is not a trace file")
+            if version != TRACE_VERSION:
+                raise ValueError(f"Unsupported trace version {version}")
+            metadata_size, = struct.unpack("<I", file.read(4))
+            self.metadata = json.loads(file.read(metadata_size))
+        # Records written after the last header update are kept
+        count = max(count, (os.path.getsize(file_path) - self.data_offset)//TRACE_DTYPE.itemsize)
+        if count > 0:
+            self.records = np.memmap(file_path, dtype=TRACE_DTYPE, mode="r", offset=self.data_offset, shape=(count,))
+        else:
+            self.records = np.zeros(0, dtype=TRACE_DTYPE)
+
+    def __len__(self):
+        return self.records.size
+
+    # Getters
+    #===========================================================================
+    def get_metadata(self):
+        return self.metadata
+
+    def get_column(self, name: str):
+        """
+        Returns a column ("start", "duration", "power" or "battery"), without copy
+        """
+        return self.records[name]
+
+    def get_total_time(self):
+        if self.records.size == 0:
+            return 0.0
+        last = self.records[-1]
+        return float(last["start"] + last["duration"])
+
+    def time_slice(self, start: float, end: float):
+        """
+        Returns the records of the segments overlapping [start, end), without copy
+        """
+        starts = self.records["start"]
+        first = max(int(np.searchsorted(starts, start, side="right")) - 1, 0)
+        last = int(np.searchsorted(starts, end, side="left"))
+        return self.records[first:last]
+
+# Function
+#===========================================================================
+def simulate(profile, battery, n_cycles: int=1, initial: float=None):
+    """
+    Generator of the (start, duration, power, battery level) arrays of a profile repeated n_cycles times on a battery
+    Arrays hold at most about CHUNK_RECORDS segments, the battery level is taken at the end of each segment
+    The simulation stops when the battery is empty, the last segment is cut at the depletion time
+    An empty battery (initial <= 0) gives an empty trace
+    """
+    if initial is None:
+        initial = battery.get_current_capacity()
+    net_energy, _ = profile.get_net_energy(battery.get_efficiency(), battery.get_input_power())
+    n_segments = profile.power.size
+    if n_segments == 0 or n_cycles <= 0 or initial <= 0:
+        return
+    cycle_time = profile.get_total_time()
+    cycle_net = float(net_energy[-1])
+    cycles_per_chunk = max(1, CHUNK_RECORDS//n_segments)
+
+    for first_cycle in range(0, n_cycles, cycles_per_chunk):
+        cycles = np.arange(first_cycle, min(first_cycle + cycles_per_chunk, n_cycles))
+        start = (cycles[:, None]*cycle_time + profile.start[None, :]).ravel()
+        duration = np.tile(profile.duration, cycles.size)
+        power = np.tile(profile.power, cycles.size)
+        level = (initial - (cycles[:, None]*cycle_net + net_energy[None, :])).ravel()
+        empty = np.flatnonzero(level <= 0)
+        if empty.size > 0:
+            # Cut the segment in which the battery empties
+            # The first segment of a chunk starts from the level at the end of the previous chunk
+            last = int(empty[0])
+            previous_level = level[last-1] if last > 0 else initial - first_cycle*cycle_net
+            rate = power[last]*(100/battery.get_efficiency()) - battery.get_input_power()
+            duration[last] = previous_level/rate
+            level[last] = 0
+            yield start[:last+1], duration[:last+1], power[:last+1], level[:last+1]
+            return
+        yield start, duration, power, level
+
+def write_simulation(file_path: str, profile, battery, n_cycles: int=1, initial: float=None, metadata: dict=None):
+    """
+    Write the trace of a profile repeated n_cycles times on a battery, see simulate
+    Returns the number of segments written
+    """
+    with TraceWriter(file_path, metadata) as writer:
+        for start, duration, power, level in simulate(profile, battery, n_cycles, initial):
+            writer.append(start, duration, power, level)
+        return writer.count
@@ -0,0 +1,117 @@
+# File: usage_index.py
+"""
+This file contains the reverse index from elements to their usages
+
+For each element name, the index keeps the set of (sequence, state index, power state)
+where the element is used. It is updated by the App and by the sequences
+it indexes, so "where is this part used" does not scan the whole project.
+Sequences added are indexed on the first query, so loading many sequences
+for a report does not pay for the index.
+
+"""
+
+from src.logger import logger
+
+class UsageIndex:
+    def __init__(self):
+        self.usages = {} # {element name: {(sequence, state index, power state)}}
+        self.entries = {} # {sequence: {state index: [(element name, power state)]}}
+        self.pending = {} # {sequence: None}, added and not indexed yet
+
+    # Getters
+    #===========================================================================
+    def get_usages(self, element_name: str):
+        """
+        Returns the set of (sequence, state index, power state) using the element
+        """
+        self.__index_pending()
+        return set(self.usages.get(element_name, ()))
+
+    def get_usage_count(self, element_name: str):
+        self.__index_pending()
+        return len(self.usages.get(element_name, ()))
+
+    def get_sequences(self, element_name: str):
+        """
+        Returns the set of sequences using the element
+        """
+        self.__index_pending()
+        return {sequence for sequence, _, _ in self.usages.get(element_name, ())}
+
+    # Methods
+    #===========================================================================
+    def __add_entries(self, sequence, index: int, state):
+        entries = [(elt["element"].get_name(), elt["power_state"]) for elt in state.elements]
+        self.entries[sequence][index] = entries
+        for element_name, power_state in entries:
+            self.usages.setdefault(element_name, set()).add((sequence, index, power_state))
+
+    def __remove_entries(self, sequence, index: int):
+        for element_name, power_state in self.entries[sequence].pop(index, []):
+            usages = self.usages.get(element_name)
+            if usages is None:
+                continue
+            usages.discard((sequence, index, power_state))
+            if not usages:
+                del self.usages[element_name]
+
+    def __index_pending(self):
+        pending = list(self.pending)
+        self.pending.clear()
+        for sequence in pending:
+            self.index_sequence(sequence)
+
+    def add_sequence(self, sequence):
+        """
+        Register a sequence, its states are indexed on the next query and the sequence keeps the index up to date
+        """
+        self.entries.setdefault(sequence, {})
+        sequence.set_usage_index(self)
+        self.pending[sequence] = None
+
+    def remove_sequence(self, sequence):
+        if sequence not in self.entries:
+            return
+        self.pending.pop(sequence, None)
+        for index in list(self.entries[sequence]):
+            self.__remove_entries(sequence, index)
+        del self.entries[sequence]
+        sequence.set_usage_index(None)
+
+    def index_sequence(self, sequence):
+        """
+        Index again all the states of a sequence, used when states are added, removed or moved
+        """
+        if sequence in self.pending:
+            return
+        for index in list(self.entries[sequence]):
+            self.__remove_entries(sequence, index)
+        for index, state in enumerate(sequence.states):
+            self.__add_entries(sequence, index, state)
+
+    def index_state(self, sequence, state):
+        """
+        Index again a state of a sequence, used when its elements change
+        """
+        if sequence in self.pending:
+            return
+        for index, indexed_state in enumerate(sequence.states):
+            if indexed_state is state:
+                self.__remove_entries(sequence, index)
+                self.__add_entries(sequence, index, state)
+
+    def rename_element(self, old_name: str, new_name: str):
+        """
+        Move the usages of an element to its new name
+        """
+        self.__index_pending()
+        usages = self.usages.pop(old_name, set())
+        if not usages:
+            return
+        self.usages.setdefault(new_name, set()).update(usages)
+        for sequence, index, _ in usages:
+            self.entries[sequence][index] = [
+                (new_name if element_name == old_name else element_name, power_state)
+                for element_name, power_state in self.entries[sequence][index]
+            ]
+        logger.debug(f"{len(usages)} usages of {old_name} renamed to {new_name}")
@@ -0,0 +1,61 @@
+# File: watcher.py
+"""
+This file contains the polling watcher of the data directories
+
+A DirectoryWatcher keeps the modification time and size of every json file
+of a directory, read with os.scandir. Each poll compares them with the
+previous scan and returns the files added, changed and removed since.
+There is no thread: the caller polls, for example from a GUI timer.
+
+"""
+
+import os
+
+class ChangeSet:
+    """
+    Names of the objects added, changed and removed by a reload
+    """
+    def __init__(self):
+        self.added = set()
+        self.changed = set()
+        self.removed = set()
+
+    def __str__(self):
+        return f"{len(self.added)} added, {len(self.changed)} changed, {len(self.removed)} removed"
+
+    def is_empty(self):
+        return not (self.added or self.changed or self.removed)
+
+class DirectoryWatcher:
+    def __init__(self, path: str, exclude: tuple=()):
+        self.path = path
+        self.exclude = exclude # File names not watched
+        self.snapshot = self.scan() # {file name: (mtime_ns, size)}
+
+    # Methods
+    #===========================================================================
+    def scan(self):
+        """
+        Returns {file name: (mtime_ns, size)} of the json files of the directory
+        """
+        snapshot = {}
+        try:
+            with os.scandir(self.path) as entries:
+                for entry in entries:
+                    if entry.name.endswith(".json") and entry.name not in self.exclude and entry.is_file():
+                        stat = entry.stat()
+                        snapshot[entry.name] = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            pass
+        return snapshot
+
+    def poll(self):
+        """
+        Returns the sorted paths of the files new or changed since the last poll,
+        and the paths of the files removed
+        """
+        snapshot = self.scan()
+        changed = [file_name for file_name, stat in snapshot.items() if self.snapshot.get(file_name) != stat]
+        removed = [file_name for file_name in self.snapshot if file_name not in snapshot]
+        self.snapshot = snapshot
+        return [os.path.join(self.path, file_name) for file_name in sorted(changed)], [os.path.join(self.path, file_name) for file_name in sorted(removed)]